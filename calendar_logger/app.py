@@ -1,18 +1,46 @@
+import calendar
 import customtkinter as ctk
 import locale
 import math
-import threading
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from tkinter import messagebox, Toplevel, ttk
 from tkcalendar import Calendar
 from calendar_logger import zoho_api
+from calendar_logger import zoho_async
 from calendar_logger import settings_manager
+from calendar_logger.instrumentation import get_logger, timed
+
+# Manutenzione del database (archiviazione, ANALYZE, VACUUM): primo avvio e intervallo
+MAINTENANCE_DELAY_MS = 60 * 1000
+MAINTENANCE_INTERVAL_MS = 6 * 60 * 60 * 1000
+# Sync incrementale dei dati Zoho: primo avvio e intervallo (sotto il TTL dei task)
+ZOHO_SYNC_DELAY_MS = 10 * 1000
+ZOHO_SYNC_INTERVAL_MS = 30 * 60 * 1000
+# Alcune risposte di Zoho hanno solo project_name
+PROJECT_NAME_KEYS = ("name", "project_name")
+
+logger = get_logger(__name__)
+
+
+def _extract_id(obj):
+    """Id of a Zoho project or task as sent to the API (id_string first), or None."""
+    if not isinstance(obj, dict):
+        return None
+    for key in ("id_string", "id", "project_id", "task_id", "zgid"):
+        if key in obj and obj[key] is not None:
+            return str(obj[key])
+    return None
 
 
 class App(ctk.CTk):
-    def __init__(self, db):
+    def __init__(self, db, outbox=None):
         super().__init__()
         self.db = db
+        # Worker che invia a Zoho i log in coda; aggiorna il calendario quando cambiano
+        self.outbox = outbox
+        if outbox is not None:
+            outbox.on_change = lambda: self.after(0, self.refresh_events)
         self.event_widgets = []
         self.calendar_cells = []
         self.calendar_start_hour = 8
@@ -24,7 +52,7 @@ class App(ctk.CTk):
             try:
                 locale.setlocale(locale.LC_TIME, 'Italian_Italy.1252')
             except locale.Error:
-                print("Locale italiano non trovato")
+                logger.warning("Locale italiano non trovato")
 
         self.title("Calendario Eventi e Logging")
         self.geometry("1200x800")
@@ -49,6 +77,19 @@ class App(ctk.CTk):
             top_frame, text="Sett. Succ. >", command=self.next_week)
         next_week_btn.grid(row=0, column=2, padx=5)
 
+        self.search_entry = ctk.CTkEntry(
+            top_frame, placeholder_text="Cerca eventi...", width=200)
+        self.search_entry.grid(row=0, column=3, padx=5)
+        self.search_entry.bind("<Return>", lambda e: self.search_events())
+        search_btn = ctk.CTkButton(
+            top_frame, text="Cerca", width=60, command=self.search_events)
+        search_btn.grid(row=0, column=4, padx=5)
+
+        self.summary_var = ctk.StringVar()
+        summary_label = ctk.CTkLabel(
+            top_frame, textvariable=self.summary_var, font=ctk.CTkFont(size=12))
+        summary_label.grid(row=1, column=0, columnspan=5, pady=(0, 5))
+
         self.calendar_frame = ctk.CTkFrame(self)
         self.calendar_frame.grid(
             row=1, column=0, columnspan=5, sticky="nsew", padx=10, pady=10)
@@ -58,7 +99,7 @@ class App(ctk.CTk):
         self.action_frame = ctk.CTkFrame(self)
         self.action_frame.grid(row=2, column=0, columnspan=5,
                                padx=10, pady=10, sticky="ew")
-        self.action_frame.grid_columnconfigure((0, 1), weight=1)
+        self.action_frame.grid_columnconfigure((0, 1, 2, 3), weight=1)
         self.add_event_button = ctk.CTkButton(
             self.action_frame, text="Aggiungi Evento", command=self.open_add_event_window)
         self.add_event_button.grid(
@@ -66,7 +107,71 @@ class App(ctk.CTk):
         self.settings_button = ctk.CTkButton(
             self.action_frame, text="Impostazioni", command=self.open_settings_window)
         self.settings_button.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        self.zoho_refresh_button = ctk.CTkButton(
+            self.action_frame, text="Aggiorna da Zoho", command=self.refresh_zoho_cache)
+        self.zoho_refresh_button.grid(
+            row=0, column=2, padx=5, pady=5, sticky="ew")
+        self.week_log_button = ctk.CTkButton(
+            self.action_frame, text="Logga Settimana", command=self.open_week_log_window)
+        self.week_log_button.grid(row=0, column=3, padx=5, pady=5, sticky="ew")
         self.rebuild_calendar()
+        settings_manager.subscribe(self._on_settings_changed)
+        self.after(MAINTENANCE_DELAY_MS, self.run_db_maintenance)
+        self.after(ZOHO_SYNC_DELAY_MS, self.run_zoho_sync)
+
+    def _on_settings_changed(self, kind, old, new):
+        # Può essere chiamato da un altro thread: ridisegna sul thread di Tk
+        if kind == "calendar_hours":
+            self.after(0, self.rebuild_calendar)
+
+    def run_db_maintenance(self):
+        """Archives old logged events and compacts the database in background."""
+        future = zoho_async.run_blocking(self.db.run_maintenance)
+        future.add_done_callback(self._log_background_error("Manutenzione database non riuscita"))
+        self.after(MAINTENANCE_INTERVAL_MS, self.run_db_maintenance)
+
+    def run_zoho_sync(self):
+        """Merges the Zoho changes since the last sync into the cache, in background."""
+        portal_id = settings_manager.get_credentials().get("portal_id")
+        if portal_id:
+            future = zoho_async.submit(zoho_async.client.sync_portal(
+                portal_id, priority=zoho_api.PRIORITY_BACKGROUND))
+            future.add_done_callback(
+                self._log_background_error("Sync Zoho non riuscita", returns_error=True))
+        self.after(ZOHO_SYNC_INTERVAL_MS, self.run_zoho_sync)
+
+    @staticmethod
+    def _log_background_error(message, returns_error=False):
+        # Callback per i job periodici: nessuno li aspetta, l'errore finisce nel log.
+        # Con returns_error il job restituisce il messaggio d'errore invece di sollevarlo.
+        def log(future):
+            error = future.exception()
+            if error is None and returns_error:
+                error = future.result()
+            if error:
+                logger.warning("%s: %s", message, error)
+        return log
+
+    def refresh_zoho_cache(self):
+        """Downloads projects, tasks and users again, ignoring the local cache."""
+        portal_id = settings_manager.get_credentials().get("portal_id")
+        if not portal_id:
+            messagebox.showerror(
+                "Errore", "Imposta il Portal ID nelle impostazioni.")
+            return
+        self.zoho_refresh_button.configure(
+            state="disabled", text="Aggiornamento...")
+
+        def finish_refresh(future):
+            self.zoho_refresh_button.configure(
+                state="normal", text="Aggiorna da Zoho")
+            error = future.exception() or future.result()
+            if error:
+                messagebox.showerror(
+                    "Errore", f"Aggiornamento da Zoho non riuscito: {error}")
+
+        zoho_async.submit(zoho_async.client.sync_portal(portal_id, full=True)).add_done_callback(
+            lambda future: self.after(0, finish_refresh, future))
 
     def change_week(self, weeks_delta):
         self.current_week_start += timedelta(weeks=weeks_delta)
@@ -78,6 +183,39 @@ class App(ctk.CTk):
     def next_week(self):
         self.change_week(1)
 
+    def go_to_date(self, date):
+        """Shows the week containing the given date."""
+        self.current_week_start = date - timedelta(days=date.weekday())
+        self.rebuild_calendar()
+
+    def search_events(self):
+        query = self.search_entry.get().strip()
+        if not query:
+            return
+        results = self.db.search_events(query, limit=20)
+        if not results:
+            messagebox.showinfo("Ricerca", f"Nessun evento trovato per '{query}'.")
+            return
+
+        dialog = ctk.CTkToplevel(self)
+        dialog.title(f"Risultati per '{query}'")
+        dialog.geometry("450x400")
+        dialog.transient(self)
+        results_frame = ctk.CTkScrollableFrame(dialog)
+        results_frame.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def jump_to(event):
+            dialog.destroy()
+            self.go_to_date(event.start)
+
+        for event in results:
+            ctk.CTkButton(
+                results_frame,
+                text=f"{event['start_time']}  {event['name']}",
+                anchor="w",
+                command=lambda ev=event: jump_to(ev)
+            ).pack(fill="x", padx=5, pady=2)
+
     def open_datepicker(self, date_var, on_close_callback):
         top = ctk.CTkToplevel(self)
         top.title("Seleziona Data")
@@ -102,6 +240,111 @@ class App(ctk.CTk):
             top, text="Conferma", command=set_date_and_close)
         confirm_button.pack(pady=10)
 
+    def _after_db_write(self, result, on_done):
+        """Runs on_done on the Tk thread once a database write has completed.
+
+        In WAL mode the Database returns a Future and the write happens on its
+        writer thread, so the UI never waits for the disk.
+        """
+        if not isinstance(result, Future):
+            on_done()
+            return
+
+        def finish(future):
+            error = future.exception()
+            if error:
+                messagebox.showerror(
+                    "Errore Database", f"Operazione non riuscita: {error}")
+                return
+            on_done()
+
+        result.add_done_callback(
+            lambda future: self.after(0, finish, future))
+
+    def _run_zoho(self, coro, on_done):
+        """Runs a zoho_async coroutine on the background loop.
+
+        on_done(value, error) is called on the Tk thread; the coroutine must
+        return a (value, error) tuple like the zoho_api functions.
+        """
+        def finish(future):
+            error = future.exception()
+            if error:
+                on_done(None, str(error))
+            else:
+                on_done(*future.result())
+
+        zoho_async.submit(coro).add_done_callback(
+            lambda future: self.after(0, finish, future))
+
+    def _stream_zoho(self, pages, on_page, on_done):
+        """Consumes a zoho_async page iterator on the background loop.
+
+        on_page(items) is called on the Tk thread for every page as it
+        arrives, then on_done(error) once, with error None on success.
+        """
+        async def consume():
+            try:
+                async for items, error in pages:
+                    if error:
+                        return error
+                    self.after(0, on_page, items)
+                return None
+            finally:
+                await pages.aclose()
+
+        def finish(future):
+            error = future.exception()
+            on_done(str(error) if error else future.result())
+
+        zoho_async.submit(consume()).add_done_callback(
+            lambda future: self.after(0, finish, future))
+
+    def _stream_choices(self, combo, pages, choices, default_name, empty_text,
+                        on_first=None, is_current=None, name_keys=("name",)):
+        """Fills a combobox from a zoho_async page iterator, appending names as pages arrive.
+
+        ``choices`` ({name: item}) is cleared and filled in place, keeping the
+        first item of each name (the first of ``name_keys`` present in the
+        item, else ``default_name``), and
+        on_first(name) runs when the first choice is shown. Pages arriving
+        after the combobox is destroyed, or once is_current() returns False,
+        are ignored.
+        """
+        choices.clear()
+        combo.configure(state="disabled", values=["Caricamento..."])
+        combo.set("Caricamento...")
+
+        def active():
+            return combo.winfo_exists() and (is_current is None or is_current())
+
+        def add_page(items):
+            if not active():
+                return
+            first = not choices
+            for item in items:
+                name = next((item[key] for key in name_keys if key in item), default_name)
+                choices.setdefault(name, item)
+            if not choices:
+                return
+            combo.configure(state="normal", values=list(choices))
+            if first:
+                name = next(iter(choices))
+                combo.set(name)
+                if on_first is not None:
+                    on_first(name)
+
+        def finish(error):
+            if not active():
+                return
+            if error:
+                combo.set(f"Errore: {error}")
+            elif not choices:
+                combo.configure(values=[empty_text])
+                combo.set(empty_text)
+
+        self._stream_zoho(pages, add_page, finish)
+
     def rebuild_calendar(self):
         for widget in self.calendar_frame.winfo_children():
             widget.destroy()
@@ -165,6 +408,7 @@ class App(ctk.CTk):
         except ValueError:
             summary_var.set("Data non valida")
 
+    @timed("app.create_calendar_grid")
     def create_calendar_grid(self):
         start_of_week = self.current_week_start
         end_of_week = start_of_week + timedelta(days=4)
@@ -204,28 +448,43 @@ class App(ctk.CTk):
                 row_cells.append(cell_frame)
             self.calendar_cells.append(row_cells)
 
+    def refresh_summary(self):
+        """Shows logged/unlogged hours for the visible week and its month."""
+        week_start = self.current_week_start
+        week = self.db.get_hours_summary(
+            week_start.strftime("%Y-%m-%d"),
+            (week_start + timedelta(days=6)).strftime("%Y-%m-%d"))
+        month_days = calendar.monthrange(week_start.year, week_start.month)[1]
+        month = self.db.get_hours_summary(
+            week_start.strftime("%Y-%m-01"), week_start.strftime(f"%Y-%m-{month_days:02d}"))
+        self.summary_var.set(
+            f"Settimana: {week['logged']:.1f}h loggate, {week['unlogged']:.1f}h da loggare  |  "
+            f"{week_start.strftime('%B %Y')}: {month['logged']:.1f}h loggate, "
+            f"{month['unlogged']:.1f}h da loggare")
+
+    def get_week_events(self):
+        """Returns the local events of the visible week."""
+        start_str = self.current_week_start.strftime("%Y-%m-%d 00:00:00")
+        end_str = (self.current_week_start + timedelta(days=5)
+                   ).strftime("%Y-%m-%d 23:59:59")
+        return self.db.get_events_for_week(start_str, end_str)
+
+    @timed("app.refresh_events")
     def refresh_events(self):
+        self.refresh_summary()
+
         # Pulizia dei bottoni esistenti
         for widget in self.event_widgets:
             widget.destroy()
         self.event_widgets.clear()
 
-        # Intervallo settimana corrente
-        start_str = self.current_week_start.strftime("%Y-%m-%d 00:00:00")
-        end_str = (self.current_week_start + timedelta(days=5)
-                   ).strftime("%Y-%m-%d 23:59:59")
-
-        # Recupera tutti gli eventi (locali)
-        events = self.db.get_events_for_week(start_str, end_str)
+        # Recupera tutti gli eventi (locali) della settimana corrente
+        events = self.get_week_events()
 
         # Creazione bottoni nella griglia
         for event in events:
-            try:
-                start_dt = datetime.strptime(
-                    event['start_time'], '%Y-%m-%d %H:%M')
-                end_dt = datetime.strptime(event['end_time'], '%Y-%m-%d %H:%M')
-            except ValueError:
-                continue
+            start_dt = event.start
+            end_dt = event.end
             if start_dt.weekday() > 4:  # solo lun-ven
                 continue
 
@@ -240,14 +499,20 @@ class App(ctk.CTk):
             is_logged = event.get('is_logged') == 1
             now = datetime.now()
 
+            event_text = f"{event['name']}"
             if is_logged:
                 fg_color = "#c9514a"
+            elif event.outbox_status == "pending":
+                fg_color = "#f0ad4e"
+                event_text += " (invio in corso)"
+            elif event.outbox_status == "failed":
+                fg_color = "#b07cc6"
+                event_text += " (invio fallito)"
             elif now > end_dt + timedelta(minutes=30):
                 fg_color = "#22b845"
             else:
                 fg_color = "#3b8ed0"
 
-            event_text = f"{event['name']}"
             event_button = DraggableEventButton(
                 self.scrollable_frame,
                 event=event,
@@ -339,7 +604,6 @@ class App(ctk.CTk):
             self.save_settings_action(client_id_entry, client_secret_entry, refresh_token_entry,
                                       api_domain_entry, portal_id_entry, email_entry, start_hour_entry, end_hour_entry)
             dialog.destroy()
-            self.rebuild_calendar()
 
         def validate_and_save():
             self.save_settings_action(client_id_entry, client_secret_entry, refresh_token_entry,
@@ -365,7 +629,7 @@ class App(ctk.CTk):
         )
         settings_manager.save_calendar_hours(
             start_hour_entry.get(), end_hour_entry.get())
-        print("Impostazioni salvate.")
+        logger.info("Impostazioni salvate.")
 
     def validate_user_email_action(self):
         creds = settings_manager.get_credentials()
@@ -388,9 +652,8 @@ class App(ctk.CTk):
         progress.pack(pady=10, fill="x", padx=20)
         progress.start(10)  # velocità spinner
 
-        # Esegui la chiamata in background per non bloccare l'interfaccia
-        def run_validation():
-            user, message = zoho_api.get_user_by_email(portal_id, email)
+        # La chiamata gira sul loop asincrono per non bloccare l'interfaccia
+        def show_validation(user, message):
             spinner_window.destroy()  # chiudiamo lo spinner quando finisce
             if user:
                 messagebox.showinfo("Validazione Utente",
@@ -398,49 +661,31 @@ class App(ctk.CTk):
             else:
                 messagebox.showerror("Validazione Utente", message)
 
-        # Importante: usare thread per non bloccare Tkinter
-        import threading
-        threading.Thread(target=run_validation, daemon=True).start()
+        self._run_zoho(zoho_async.client.get_user_by_email(portal_id, email), show_validation)
 
     def execute_zoho_log(self, log_dialog, event_dialog, event, portal_id, project_id, task_id, notes, bill_status):
-        creds = settings_manager.get_credentials()
-        email = creds.get("email")
-
-        user, error = zoho_api.get_user_by_email(portal_id, email)
-        if error:
-            messagebox.showerror(
-                "Errore Utente", f"Impossibile recuperare l'utente: {error}")
-            return
-
-        owner_zpuid = user.get('id')
-
-        start_dt = datetime.strptime(event['start_time'], '%Y-%m-%d %H:%M')
-        end_dt = datetime.strptime(event['end_time'], '%Y-%m-%d %H:%M')
-
-        log_date = start_dt.strftime("%Y-%m-%d")
-        start_time = start_dt.strftime("%H:%M")
-        end_time = end_dt.strftime("%H:%M")
-
-        response = zoho_api.log_time_to_zoho(
-            portal_id=portal_id,
-            project_id=project_id,
-            task_id=task_id,
-            event_name=event['name'],
-            notes=notes,
-            log_date=log_date,
-            start_time=start_time,
-            end_time=end_time,
-            bill_status=bill_status,
-            owner_zpuid=owner_zpuid
-        )
-
-        if response["success"]:
-            self.db.set_event_logged(event['id'])
-            log_dialog.destroy()
-            event_dialog.destroy()
+        """Queues the time log in the outbox: the worker sends it in background."""
+        start_dt = event.start
+        end_dt = event.end
+        payload = {
+            "project_id": project_id,
+            "task_id": task_id,
+            "event_name": event['name'],
+            "notes": notes,
+            "log_date": start_dt.strftime("%Y-%m-%d"),
+            "start_time": start_dt.strftime("%H:%M"),
+            "end_time": end_dt.strftime("%H:%M"),
+            "bill_status": bill_status,
+        }
+        log_dialog.destroy()
+        event_dialog.destroy()
+
+        def on_queued():
+            if self.outbox is not None:
+                self.outbox.notify()
             self.refresh_events()
-        else:
-            messagebox.showerror("Errore Log Zoho", response['message'])
+
+        self._after_db_write(self.db.enqueue_zoho_log(event['id'], payload), on_queued)
 
     def open_add_event_window(self):
         dialog = ctk.CTkToplevel(self)
@@ -507,9 +752,10 @@ class App(ctk.CTk):
             return
 
         try:
-            self.db.add_event(name, description, start_time_str, end_time_str)
+            result = self.db.add_event(
+                name, description, start_time_str, end_time_str)
             dialog.destroy()
-            self.refresh_events()
+            self._after_db_write(result, self.refresh_events)
         except Exception as e:
             messagebox.showerror(
                 "Errore", f"Impossibile salvare l'evento: {e}")
@@ -525,7 +771,9 @@ class App(ctk.CTk):
         dialog.grab_set()
 
         is_logged = event.get('is_logged') == 1
-        form_state = "disabled" if is_logged else "normal"
+        # Un log in coda conta come loggato: niente modifiche né secondo invio
+        is_pending = event.outbox_status == "pending"
+        form_state = "disabled" if is_logged or is_pending else "normal"
 
         # Nome evento
         ctk.CTkLabel(dialog, text="Nome:").pack(
@@ -543,8 +791,8 @@ class App(ctk.CTk):
         desc_box.configure(state=form_state)
 
         # Datetime picker
-        start_dt = datetime.strptime(event['start_time'], '%Y-%m-%d %H:%M')
-        end_dt = datetime.strptime(event['end_time'], '%Y-%m-%d %H:%M')
+        start_dt = event.start
+        end_dt = event.end
         start_date_var, start_hour_var, start_min_var = self._create_datetime_picker(
             dialog, "Inizio", start_dt, form_state)
         end_date_var, end_hour_var, end_min_var = self._create_datetime_picker(
@@ -584,7 +832,7 @@ class App(ctk.CTk):
         delete_button.grid(row=0, column=0, padx=10, pady=10, sticky="ew")
 
         # Pulsante Salva
-        if not is_logged and not is_past:
+        if not is_logged and not is_pending and not is_past:
             def update_action():
                 start_time_str = f"{start_date_var.get()} {start_hour_var.get()}:{start_min_var.get()}"
                 end_time_str = f"{end_date_var.get()} {end_hour_var.get()}:{end_min_var.get()}"
@@ -596,57 +844,10 @@ class App(ctk.CTk):
             save_button.grid(row=0, column=1, padx=10, pady=10, sticky="ew")
 
         # Pulsante Logga su Zoho per eventi passati o futuri loggabili
-        if not is_logged:
-            progress_bar = ctk.CTkProgressBar(
-                button_frame, mode="indeterminate")
-            progress_bar.grid(row=1, column=0, columnspan=2,
-                            sticky="ew", padx=10, pady=5)
-            progress_bar.grid_remove()  # Nascondi inizialmente
-
+        if not is_logged and not is_pending:
             def log_on_zoho():
-                # Mostra spinner
-                progress_bar.grid()
-                progress_bar.start()
-                # Disabilita pulsanti
-                for child in button_frame.winfo_children():
-                    if isinstance(child, ctk.CTkButton):
-                        child.configure(state="disabled")
-
-                def thread_log():
-                    try:
-                        creds = settings_manager.get_credentials()
-                        portal_id = creds.get("portal_id")
-
-                        # Scarica progetti e tasks al click del pulsante
-                        projects, err_proj = zoho_api.get_projects(portal_id)
-                        if err_proj:
-                            messagebox.showerror(
-                                "Errore", f"Errore caricamento progetti: {err_proj}")
-                            return
-
-                        tasks_dict = {}
-                        for project in projects:
-                            tasks, err_task = zoho_api.get_tasks(
-                                portal_id, project['id'])
-                            if err_task:
-                                messagebox.showerror(
-                                    "Errore",
-                                    f"Errore caricamento task progetto {project['name']}: {err_task}"
-                                )
-                                return
-                            tasks_dict[project['id']] = tasks
-
-                        # Una volta caricati dati, apri finestra log
-                        self.open_zoho_log_window(
-                            dialog, event, projects, tasks_dict)
-                    finally:
-                        progress_bar.stop()
-                        progress_bar.grid_remove()
-                        for child in button_frame.winfo_children():
-                            if isinstance(child, ctk.CTkButton):
-                                child.configure(state="normal")
-
-                threading.Thread(target=thread_log, daemon=True).start()
+                # Progetti e task arrivano nella finestra man mano che Zoho risponde
+                self.open_zoho_log_window(dialog, event)
 
             log_button = ctk.CTkButton(
                 button_frame,
@@ -664,18 +865,124 @@ class App(ctk.CTk):
                 text_color="#c9514a"
             )
             logged_label.pack(pady=20)
+        elif is_pending:
+            ctk.CTkLabel(
+                dialog,
+                text="Log in invio a Zoho: l'evento verrà segnato come loggato appena confermato.",
+                text_color="#f0ad4e", wraplength=400
+            ).pack(pady=20)
+        elif event.outbox_status == "failed":
+            ctk.CTkLabel(
+                dialog,
+                text="Invio a Zoho non riuscito dopo vari tentativi: usa \"Logga su Zoho\" per riprovare.",
+                text_color="#b07cc6", wraplength=400
+            ).pack(pady=20)
 
     def update_event_action(self, dialog, event_id, name, description, start_time, end_time):
-        self.db.update_event(event_id, name, description, start_time, end_time)
+        result = self.db.update_event(
+            event_id, name, description, start_time, end_time)
         dialog.destroy()
-        self.refresh_events()
+        self._after_db_write(result, self.refresh_events)
 
     def delete_event_action(self, dialog, event_id):
-        self.db.delete_event(event_id)
+        result = self.db.delete_event(event_id)
         dialog.destroy()
-        self.refresh_events()
+        self._after_db_write(result, self.refresh_events)
+
+    def open_week_log_window(self):
+        """Queues a log on one project/task for every finished, not yet logged event of the week."""
+        now = datetime.now()
+        events = [e for e in self.get_week_events()
+                  if e.is_logged != 1 and e.outbox_status != "pending" and e.end < now]
+        if not events:
+            messagebox.showinfo(
+                "Logga Settimana", "Nessun evento da loggare in questa settimana.")
+            return
+        portal_id = settings_manager.get_credentials().get("portal_id")
+        if not portal_id:
+            messagebox.showerror(
+                "Errore", "Imposta il Portal ID nelle impostazioni.")
+            return
 
-    def open_zoho_log_window(self, parent_dialog, event, projects=None, tasks_dict=None):
+        dialog = ctk.CTkToplevel(self)
+        dialog.title("Logga Settimana su Zoho")
+        dialog.geometry("450x320")
+        dialog.grid_columnconfigure(1, weight=1)
+        dialog.transient(self)
+        dialog.grab_set()
+
+        total_hours = sum((e.end - e.start).total_seconds()
+                          for e in events) / 3600
+        ctk.CTkLabel(dialog, text=f"{len(events)} eventi da loggare ({total_hours:.1f}h)").grid(
+            row=0, column=0, columnspan=2, padx=10, pady=10)
+        ctk.CTkLabel(dialog, text="Progetto:").grid(
+            row=1, column=0, padx=10, pady=10, sticky="w")
+        project_combo = ctk.CTkComboBox(
+            dialog, values=["Caricamento..."], state="disabled")
+        project_combo.grid(row=1, column=1, padx=10, pady=10, sticky="ew")
+        ctk.CTkLabel(dialog, text="Task:").grid(
+            row=2, column=0, padx=10, pady=10, sticky="w")
+        task_combo = ctk.CTkComboBox(
+            dialog, values=["Seleziona un progetto"], state="disabled")
+        task_combo.grid(row=2, column=1, padx=10, pady=10, sticky="ew")
+        billable_var = ctk.StringVar(value="Billable")
+        ctk.CTkCheckBox(dialog, text="Fatturabile", variable=billable_var,
+                        onvalue="Billable", offvalue="Non Billable").grid(
+            row=3, column=1, padx=10, pady=10, sticky="w")
+
+        projects_by_name = {}
+        tasks_by_name = {}
+        selected = {"project": None}
+
+        def on_project_selected(name):
+            project = projects_by_name.get(name)
+            if not _extract_id(project):
+                return
+            selected["project"] = project
+            self._stream_choices(
+                task_combo, zoho_async.client.iter_tasks(portal_id, _extract_id(project)),
+                tasks_by_name, "Unnamed Task", "Nessun task trovato",
+                is_current=lambda: selected["project"] is project)
+
+        def register_action():
+            project_id = _extract_id(projects_by_name.get(project_combo.get()))
+            task_id = _extract_id(tasks_by_name.get(task_combo.get()))
+            if not project_id or not task_id:
+                messagebox.showerror("Errore", "Seleziona progetto e task.")
+                return
+            # Come execute_zoho_log: gli invii passano dall'outbox, che li
+            # ritenta con la stessa chiave di idempotenza
+            logs = [(e.id, {
+                "project_id": project_id,
+                "task_id": task_id,
+                "event_name": e.name,
+                "notes": e.description or "",
+                "log_date": e.start.strftime("%Y-%m-%d"),
+                "start_time": e.start.strftime("%H:%M"),
+                "end_time": e.end.strftime("%H:%M"),
+                "bill_status": billable_var.get(),
+            }) for e in events]
+            dialog.destroy()
+
+            def on_queued():
+                if self.outbox is not None:
+                    self.outbox.notify()
+                self.refresh_events()
+
+            self._after_db_write(self.db.enqueue_zoho_logs(logs), on_queued)
+
+        log_button = ctk.CTkButton(
+            dialog, text="Registra Tutti", command=register_action)
+        log_button.grid(row=4, column=0, columnspan=2,
+                        padx=10, pady=20, sticky="ew")
+
+        project_combo.configure(command=on_project_selected)
+        self._stream_choices(
+            project_combo, zoho_async.client.iter_projects(portal_id),
+            projects_by_name, "Unnamed Project", "Nessun progetto trovato",
+            on_first=on_project_selected, name_keys=PROJECT_NAME_KEYS)
+
+    def open_zoho_log_window(self, parent_dialog, event):
         dialog = ctk.CTkToplevel(self)
         dialog.title("Log Time su Zoho")
         dialog.geometry("450x520")
@@ -685,45 +992,9 @@ class App(ctk.CTk):
 
         creds = settings_manager.get_credentials()
         portal_id = creds.get("portal_id")
-        start_dt = datetime.strptime(event['start_time'], '%Y-%m-%d %H:%M')
-        end_dt = datetime.strptime(event['end_time'], '%Y-%m-%d %H:%M')
-        duration_hours = round((end_dt - start_dt).total_seconds() / 3600, 2)
-        log_date = start_dt.strftime("%m-%d-%Y")
-
-        # Se projects e tasks_dict sono forniti, usali direttamente
-        if projects is None or tasks_dict is None:
-            projects, err_proj = zoho_api.get_projects(portal_id)
-            if err_proj:
-                    messagebox.showerror(
-                        "Errore", f"Errore caricamento progetti: {err_proj}")
-                    return
-                
-            tasks_dict = {}
-            for project in projects:
-                tasks, err_task = zoho_api.get_tasks(portal_id, project['id'])
-                if err_task:
-                    messagebox.showerror(
-                        "Errore",
-                        f"Errore caricamento task progetto {project['name']}: {err_task}"
-                    )
-                    return
-                tasks_dict[project['id']] = tasks
-
-        creds = settings_manager.get_credentials()
-        portal_id = creds.get("portal_id")
-        start_dt = datetime.strptime(event['start_time'], '%Y-%m-%d %H:%M')
-        end_dt = datetime.strptime(event['end_time'], '%Y-%m-%d %H:%M')
-        duration_hours = round((end_dt - start_dt).total_seconds() / 3600, 2)
-        log_date = start_dt.strftime("%m-%d-%Y")
-
-        # Utility per estrarre ID
-        def _extract_id(obj):
-            if not isinstance(obj, dict):
-                return None
-            for key in ("id_string", "id", "project_id", "task_id", "zgid"):
-                if key in obj and obj[key] is not None:
-                    return str(obj[key])
-            return None
+        duration_hours = round(
+            (event.end - event.start).total_seconds() / 3600, 2)
+        log_date = event.start.strftime("%m-%d-%Y")
 
         # Campi Data e Ore
         ctk.CTkLabel(dialog, text="Data Log:").grid(
@@ -765,32 +1036,23 @@ class App(ctk.CTk):
         billable_check.grid(row=5, column=1, padx=10, pady=10, sticky="w")
         billable_check.select()
 
-        projects_data = []
-        tasks_data = []
+        # Scelte per nome, riempite pagina per pagina mentre arrivano da Zoho
+        projects_by_name = {}
+        tasks_by_name = {}
+        selected = {"project_id": None}
 
         # Funzioni interne
         def on_project_selected(selected_project_name):
-            task_combo.configure(state="disabled")
-            task_combo.set("Caricamento...")
-            selected_project = next(
-                (p for p in projects_data if p['name'] == selected_project_name), None)
-            selected_project_id = _extract_id(selected_project)
+            selected_project_id = _extract_id(
+                projects_by_name.get(selected_project_name))
             if not selected_project_id:
                 return
-
-            tasks, error = zoho_api.get_tasks(portal_id, selected_project_id)
-            if error:
-                task_combo.set(f"Errore: {error}")
-                return
-
-            nonlocal tasks_data
-            tasks_data = [{"name": t.get("name", "Unnamed Task"), "id_string": _extract_id(
-                t), "_raw": t} for t in tasks]
-            task_names = [t['name'] for t in tasks_data]
-            task_combo.configure(state="normal", values=task_names if task_names else [
-                "Nessun task trovato"])
-            task_combo.set(
-                task_names[0] if task_names else "Nessun task trovato")
+            selected["project_id"] = selected_project_id
+            # I task di un progetto selezionato in precedenza vengono ignorati
+            self._stream_choices(
+                task_combo, zoho_async.client.iter_tasks(portal_id, selected_project_id),
+                tasks_by_name, "Unnamed Task", "Nessun task trovato",
+                is_current=lambda: selected["project_id"] == selected_project_id)
 
         def load_projects():
             if not portal_id:
@@ -799,38 +1061,24 @@ class App(ctk.CTk):
                 task_combo.configure(state="disabled")
                 return
 
-            projects, error = zoho_api.get_projects(portal_id)
-            if error:
-                project_combo.set(f"Errore: {error}")
-                return
-
-            nonlocal projects_data
-            projects_data = [{"name": p.get("name", p.get(
-                "project_name", "Unnamed Project")), "id_string": _extract_id(p), "_raw": p} for p in projects]
-            project_names = [p['name'] for p in projects_data]
-            project_combo.configure(values=project_names if project_names else [
-                                    "Nessun progetto trovato"], command=on_project_selected)
-            project_combo.set(
-                project_names[0] if project_names else "Nessun progetto trovato")
-            if project_names:
-                on_project_selected(project_names[0])
+            project_combo.configure(command=on_project_selected)
+            self._stream_choices(
+                project_combo, zoho_async.client.iter_projects(portal_id),
+                projects_by_name, "Unnamed Project", "Nessun progetto trovato",
+                on_first=on_project_selected, name_keys=PROJECT_NAME_KEYS)
 
         def register_action():
             selected_project_name = project_combo.get()
             selected_task_name = task_combo.get()
 
-            selected_project = next(
-                (p for p in projects_data if p['name'] == selected_project_name), None)
-            selected_task = next(
-                (t for t in tasks_data if t['name'] == selected_task_name), None)
-
-            project_id = _extract_id(selected_project)
-            task_id = _extract_id(selected_task)
+            project_id = _extract_id(
+                projects_by_name.get(selected_project_name))
+            task_id = _extract_id(tasks_by_name.get(selected_task_name))
             notes = notes_box.get("1.0", "end-1c")
             bill_status = billable_var.get()
 
             if not all([portal_id, project_id, task_id]):
-                print("Errore: Portal ID, Progetto o Task non validi")
+                logger.error("Portal ID, Progetto o Task non validi")
                 return
 
             self.execute_zoho_log(dialog, parent_dialog, event,
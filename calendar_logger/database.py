@@ -1,60 +1,1074 @@
+import calendar
+import json
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from calendar_logger.instrumentation import get_logger, increment, timed, timer
+
+logger = get_logger(__name__)
+
+# Formati accettati per le date degli eventi (il primo è quello usato dall'app)
+DATETIME_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S")
+
+
+def to_epoch(value):
+    """Converts a 'YYYY-MM-DD HH:MM[:SS]' string (or datetime) to epoch seconds.
+
+    Times are naive wall-clock values, so they are encoded as if they were UTC:
+    this matches SQLite's strftime('%s', ...) used by the schema migration.
+    """
+    if isinstance(value, datetime):
+        return calendar.timegm(value.timetuple())
+    for fmt in DATETIME_FORMATS:
+        try:
+            return calendar.timegm(datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError(f"Formato data/ora non valido: {value!r}")
+
+
+def _validate_event(event):
+    """Returns the INSERT parameters for an event dict, or raises ValueError."""
+    name = (event.get("name") or "").strip()
+    if not name:
+        raise ValueError("Nome evento mancante")
+    start_time = (event.get("start_time") or "").strip()
+    end_time = (event.get("end_time") or "").strip()
+    start_ts = to_epoch(start_time)
+    end_ts = to_epoch(end_time)
+    if end_ts < start_ts:
+        raise ValueError("La fine dell'evento precede l'inizio")
+    return (name, event.get("description") or "", start_time, end_time, start_ts, end_ts)
+
+
+def _migrate_v1(cursor):
+    """Typed epoch columns, rowid-backed id and range indexes."""
+    cursor.execute("""
+        CREATE TABLE events_v1 (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            is_logged INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'")
+    if cursor.fetchone():
+        # La vecchia tabella aveva 'id TEXT PRIMARY KEY' sempre NULL:
+        # il rowid è l'unico identificativo affidabile delle righe esistenti.
+        cursor.execute("""
+            INSERT INTO events_v1 (id, name, description, start_time, end_time,
+                                   start_ts, end_ts, is_logged)
+            SELECT rowid, name, description, start_time, end_time,
+                   COALESCE(CAST(strftime('%s', start_time) AS INTEGER), 0),
+                   COALESCE(CAST(strftime('%s', end_time) AS INTEGER), 0),
+                   is_logged
+            FROM events
+        """)
+        cursor.execute("DROP TABLE events")
+    cursor.execute("ALTER TABLE events_v1 RENAME TO events")
+    _create_event_indexes(cursor)
+
+
+def _create_event_indexes(cursor):
+    # Indice "covering" per le query per intervallo (settimana, report)
+    cursor.execute(
+        "CREATE INDEX idx_events_range ON events (start_ts, end_ts, is_logged)")
+    cursor.execute(
+        "CREATE INDEX idx_events_logged ON events (is_logged, start_ts)")
+
+
+def _migrate_v2(cursor):
+    """Full-text index over name and description, kept in sync by triggers."""
+    _create_fts_index(cursor, "main")
+
+
+def _create_fts_index(cursor, schema):
+    """Creates events_fts (and its triggers) over the events table of a schema."""
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE {schema}.events_fts USING fts5(
+            name, description,
+            content='events', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    _create_fts_triggers(cursor, schema)
+    cursor.execute(f"INSERT INTO {schema}.events_fts (events_fts) VALUES ('rebuild')")
+
+
+def _create_fts_triggers(cursor, schema="main"):
+    # I nomi nel corpo di un trigger si riferiscono allo schema del trigger
+    cursor.execute(f"""
+        CREATE TRIGGER {schema}.events_fts_ai AFTER INSERT ON events BEGIN
+            INSERT INTO events_fts (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER {schema}.events_fts_ad AFTER DELETE ON events BEGIN
+            INSERT INTO events_fts (events_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    """)
+    # Solo se cambia il testo: set_event_logged non deve toccare l'indice
+    cursor.execute(f"""
+        CREATE TRIGGER {schema}.events_fts_au AFTER UPDATE OF name, description ON events BEGIN
+            INSERT INTO events_fts (events_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO events_fts (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END
+    """)
+
+
+def _migrate_v3(cursor):
+    """Per-day rollup of event durations, split by is_logged."""
+    cursor.execute("""
+        CREATE TABLE daily_hours (
+            day TEXT NOT NULL,
+            is_logged INTEGER NOT NULL,
+            seconds INTEGER NOT NULL,
+            PRIMARY KEY (day, is_logged)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        INSERT INTO daily_hours (day, is_logged, seconds)
+        SELECT date(start_ts, 'unixepoch'), is_logged, SUM(end_ts - start_ts)
+        FROM events
+        GROUP BY 1, 2
+    """)
+
+
+def _migrate_v4(cursor):
+    """AUTOINCREMENT ids, so ids of rows moved to the archive are never reused."""
+    cursor.execute("""
+        CREATE TABLE events_v4 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            is_logged INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute(f"INSERT INTO events_v4 ({EVENT_COLUMNS}) SELECT {EVENT_COLUMNS} FROM events")
+    # DROP elimina anche indici e trigger FTS, che vanno ricreati sulla nuova tabella
+    cursor.execute("DROP TABLE events")
+    cursor.execute("ALTER TABLE events_v4 RENAME TO events")
+    _create_event_indexes(cursor)
+    _create_fts_triggers(cursor)
+
+
+def _migrate_v5(cursor):
+    """Outbox of time logs waiting to be sent to Zoho, at most one per event."""
+    cursor.execute("""
+        CREATE TABLE zoho_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL UNIQUE,
+            idempotency_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ts REAL,
+            last_error TEXT,
+            created_ts REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX idx_outbox_due ON zoho_outbox (status, next_attempt_ts)
+    """)
+
+
+def _migrate_v6(cursor):
+    """Outbox failures that do not count against MAX_ATTEMPTS (offline, timeouts)."""
+    cursor.execute("ALTER TABLE zoho_outbox ADD COLUMN retries INTEGER NOT NULL DEFAULT 0")
+
+
+def _ensure_archive_schema(cursor):
+    """Creates the events table of the attached archive file, if missing."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS archive.events (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            is_logged INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS archive.idx_events_range
+        ON events (start_ts, end_ts, is_logged)
+    """)
+    # Indice full-text anche sull'archivio, perché la ricerca copra tutto lo storico
+    cursor.execute("SELECT 1 FROM archive.sqlite_master WHERE name = 'events_fts'")
+    if cursor.fetchone() is None:
+        _create_fts_index(cursor, "archive")
+
+
+def _day_of(ts):
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def _adjust_rollup(cursor, deltas):
+    """Adds the (day, is_logged, seconds) deltas to daily_hours."""
+    cursor.executemany("""
+        INSERT INTO daily_hours (day, is_logged, seconds) VALUES (?, ?, ?)
+        ON CONFLICT (day, is_logged) DO UPDATE SET seconds = seconds + excluded.seconds
+    """, deltas)
+
+
+def _fts_query(text):
+    """Turns free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# Migrazioni dello schema, in ordine: la posizione N porta il database alla versione N+1
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Età (in giorni) oltre la quale gli eventi loggati passano all'archivio
+ARCHIVE_AFTER_DAYS = 365
+# Pagine libere (4 KiB l'una) oltre le quali la manutenzione riscrive un file con VACUUM
+VACUUM_MIN_FREE_PAGES = 256
+
+EVENT_COLUMNS = "id, name, description, start_time, end_time, is_logged, start_ts, end_ts"
+# Stato dell'eventuale invio a Zoho in coda: 'pending', 'failed' o NULL
+OUTBOX_STATUS_COLUMN = "(SELECT status FROM zoho_outbox o WHERE o.event_id = events.id)"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class Event:
+    """Compact, read-only event record returned by Database queries.
+
+    ``start`` and ``end`` are datetimes computed once from the epoch columns,
+    so callers don't need to parse start_time/end_time again. Item access
+    (event['name'], event.get('is_logged')) keeps dict-based callers working.
+    ``outbox_status`` is 'pending' or 'failed' while a Zoho log for the event
+    sits in the outbox, None otherwise.
+    """
+
+    __slots__ = ("id", "name", "description", "start_time", "end_time",
+                 "is_logged", "outbox_status", "start", "end")
+
+    _KEYS = ("id", "name", "description", "start_time", "end_time", "is_logged", "outbox_status")
+
+    def __init__(self, id, name, description, start_time, end_time, is_logged, start_ts, end_ts,
+                 outbox_status=None):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.start_time = start_time
+        self.end_time = end_time
+        self.is_logged = is_logged
+        self.outbox_status = outbox_status
+        self.start = _EPOCH + timedelta(seconds=start_ts)
+        self.end = _EPOCH + timedelta(seconds=end_ts)
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self._KEYS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._KEYS else default
+
+    def keys(self):
+        return self._KEYS
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self._KEYS}
+
+    def __repr__(self):
+        return f"Event(id={self.id!r}, name={self.name!r}, start_time={self.start_time!r})"
+
+
+def _configure_wal(conn):
+    for schema in ("main", "archive"):
+        conn.execute(f"PRAGMA {schema}.journal_mode = WAL")
+        # In WAL, NORMAL è sicuro contro la corruzione e non fa fsync a ogni commit
+        conn.execute(f"PRAGMA {schema}.synchronous = NORMAL")
+
+
+class BatchedWriter(threading.Thread):
+    """Single background thread that owns the write connection.
+
+    Operations submitted within ``commit_window`` seconds of each other are
+    executed in the same transaction, so a burst of clicks costs one fsync.
+    Each operation runs inside its own SAVEPOINT: a failing one is rolled back
+    and reported through its future without affecting the rest of the batch.
+    Operations submitted with ``transaction=False`` (e.g. VACUUM) run alone,
+    in autocommit mode, between two batches.
+    """
+
+    _STOP = object()
+
+    def __init__(self, connect, commit_window=0.05, max_batch=256):
+        super().__init__(name="db-writer", daemon=True)
+        self._connect = connect
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        # Elemento letto dalla coda che non può entrare nel batch corrente
+        self._deferred = None
+
+    def submit(self, operation, *args, after_commit=None, transaction=True):
+        """Queues operation(cursor, *args) and returns a Future with its result.
+
+        ``after_commit``, if given, is called on the writer thread once the
+        batch is committed and before the future is resolved.
+        """
+        future = Future()
+        self._queue.put((operation, args, future, after_commit, transaction))
+        return future
+
+    def close(self):
+        """Flushes pending writes and stops the thread."""
+        self._queue.put(self._STOP)
+        self.join()
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.commit_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._STOP or not item[4]:
+                self._deferred = item
+                break
+            batch.append(item)
+        return batch
+
+    @staticmethod
+    def _run_alone(cursor, item):
+        operation, args, future, after_commit, _ = item
+        try:
+            result = operation(cursor, *args)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if after_commit is not None:
+            after_commit()
+        future.set_result(result)
+
+    def run(self):
+        conn = self._connect()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        while True:
+            item, self._deferred = self._deferred or self._queue.get(), None
+            if item is self._STOP:
+                break
+            if not item[4]:
+                self._run_alone(cursor, item)
+                continue
+            batch = self._collect_batch(item)
+            results = []
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                for operation, args, future, _, _ in batch:
+                    cursor.execute("SAVEPOINT op")
+                    try:
+                        with timer(f"db.write.{operation.__name__}"):
+                            results.append((future, operation(cursor, *args), None))
+                        cursor.execute("RELEASE op")
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO op")
+                        cursor.execute("RELEASE op")
+                        results.append((future, None, e))
+                with timer("db.commit"):
+                    cursor.execute("COMMIT")
+                increment("db.batches")
+                increment("db.batched_writes", len(batch))
+            except sqlite3.Error as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                for _, _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+            for _, _, _, after_commit, _ in batch:
+                if after_commit is not None:
+                    after_commit()
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        conn.close()
+
+
+class WeekCache:
+    """Bounded LRU cache of per-window results (event lists, hour totals) keyed by (start_ts, end_ts).
+
+    Writes invalidate only the windows containing the start_ts values they
+    touched. A generation counter prevents a read that raced with a write
+    from storing results that were already stale when it finished.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (events, generation); events is None on a miss."""
+        with self._lock:
+            events = self._entries.get(key)
+            if events is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return events, self._generation
+
+    def put(self, key, events, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = events
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, ranges):
+        """Drops every window overlapping one of the (low_ts, high_ts) ranges."""
+        if not ranges:
+            return
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                start_ts, end_ts = key
+                if any(low <= end_ts and high >= start_ts for low, high in ranges):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+def _touch_event(cursor, touched, event_id):
+    """Records the current start_ts of an event before it is modified.
+
+    Also removes the event's duration from daily_hours: the caller adds it
+    back with the new values, if the row still exists afterwards.
+    Returns the (start_ts, end_ts, is_logged) row, or None.
+    """
+    cursor.execute("""
+        SELECT start_ts, end_ts, is_logged FROM events WHERE id = ?
+        UNION ALL
+        SELECT start_ts, end_ts, is_logged FROM archive.events WHERE id = ?
+    """, (event_id, event_id))
+    row = cursor.fetchone()
+    if row:
+        start_ts, end_ts, is_logged = row
+        touched.append((start_ts, start_ts))
+        _adjust_rollup(cursor, [(_day_of(start_ts), is_logged, start_ts - end_ts)])
+    return row
+
+
+class ConnectionManager:
+    """Hands out SQLite connections that are safe to use from any thread.
+
+    Reads check out a connection from a pool of at most ``max_readers``
+    (opened lazily, reused by any thread, waited for when all are busy),
+    while all writes go through a single connection serialized by a lock. In
+    WAL mode readers never wait for the writer. Note that each connection
+    opens the file separately, so ':memory:' databases are not supported.
+    """
+
+    def __init__(self, db_name, archive_name, wal=False, max_readers=4):
+        self.db_name = db_name
+        self.archive_name = archive_name
+        self.wal = wal
+        self.max_readers = max_readers
+        self._idle_readers = []
+        self._open_readers = 0
+        self._readers_cond = threading.Condition()
+        self._write_lock = threading.RLock()
+        self._write_conn = self.connect()
+
+    def connect(self):
+        """Opens a new connection with the archive file attached as 'archive'."""
+        # check_same_thread=False solo per poter chiudere tutto da close():
+        # ogni connessione viene comunque usata da un solo thread alla volta
+        conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_name,))
+        if self.wal:
+            _configure_wal(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Checks out a read connection from the pool for the duration of the block."""
+        with self._readers_cond:
+            while not self._idle_readers and self._open_readers >= self.max_readers:
+                self._readers_cond.wait()
+            conn = self._idle_readers.pop() if self._idle_readers else None
+            if conn is None:
+                self._open_readers += 1
+        if conn is None:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self._readers_cond:
+                    self._open_readers -= 1
+                    self._readers_cond.notify()
+                raise
+        try:
+            yield conn
+        finally:
+            with self._readers_cond:
+                self._idle_readers.append(conn)
+                self._readers_cond.notify()
+
+    @contextmanager
+    def writer(self):
+        """Exclusive access to the write connection; commits on success."""
+        with self._write_lock:
+            try:
+                yield self._write_conn
+            except Exception:
+                self._write_conn.rollback()
+                raise
+            self._write_conn.commit()
+
+    def close(self):
+        with self._write_lock:
+            self._write_conn.close()
+        with self._readers_cond:
+            for conn in self._idle_readers:
+                conn.close()
+            self._open_readers -= len(self._idle_readers)
+            self._idle_readers.clear()
+
 
 class Database:
-    def __init__(self, db_name="events.db"):
-        self.conn = sqlite3.connect(db_name)
-        self.cursor = self.conn.cursor()
+    def __init__(self, db_name="events.db", wal=False, commit_window=0.05, cache_size=32,
+                 archive_name=None):
+        """Opens the database.
+
+        Connections come from a ConnectionManager, so a Database can be shared
+        with worker threads. With ``wal=True`` the file is switched to WAL
+        journaling and every mutator is routed through a BatchedWriter:
+        mutators then return a concurrent.futures.Future instead of their
+        result, while reads keep running without waiting for the writer.
+
+        Old logged events live in a separate archive file (by default
+        '<db_name>_archive.db'), attached to every connection as 'archive'.
+        """
+        if archive_name is None:
+            archive_name = os.path.splitext(db_name)[0] + "_archive.db"
+        self._connections = ConnectionManager(db_name, archive_name, wal)
+        self._week_cache = WeekCache(cache_size)
+        # Totali di ore per intervallo di giorni, invalidati come le settimane
+        self._summary_cache = WeekCache(cache_size)
+        # start_ts più recente presente nell'archivio: None se è vuoto
+        self._archive_horizon = None
+        self._writer = None
+        self._maintenance_lock = threading.Lock()
+        if wal:
+            self._writer = BatchedWriter(self._connections.connect, commit_window)
+            self._writer.start()
+
+    def _write(self, operation, *args):
+        """Runs operation(cursor, touched, *args) and commits it.
+
+        The operation appends to ``touched`` the (low_ts, high_ts) ranges of
+        start_ts it changed; the matching cached weeks are invalidated once
+        the write is committed.
+        """
+        touched = []
+        if self._writer is not None:
+            return self._writer.submit(
+                operation, touched, *args,
+                after_commit=lambda: self._invalidate_caches(touched))
+        with timer(f"db.write.{operation.__name__}"), self._connections.writer() as conn:
+            result = operation(conn.cursor(), touched, *args)
+        self._invalidate_caches(touched)
+        return result
+
+    def _invalidate_caches(self, touched):
+        self._week_cache.invalidate(touched)
+        self._summary_cache.invalidate(touched)
+
+    def _query(self, sql, params=()):
+        """Runs a read query on a pooled connection and returns all its rows."""
+        with self._connections.reader() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def cache_stats(self):
+        """Returns hit/miss counters and the size of the week cache."""
+        return self._week_cache.stats()
+
+    def migrate(self):
+        """Brings the schema up to SCHEMA_VERSION, migrating existing data in place."""
+        with self._connections.writer() as conn:
+            _ensure_archive_schema(conn.cursor())
+            self._archive_horizon = conn.execute(
+                "SELECT MAX(start_ts) FROM archive.events").fetchone()[0]
+        with self._connections.writer() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            for step in range(version, SCHEMA_VERSION):
+                MIGRATIONS[step](cursor)
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        logger.info("Database migrato dalla versione %d alla %d.", version, SCHEMA_VERSION)
 
     def create_table(self):
         """Creates the events table if it doesn't exist."""
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                description TEXT,
-                start_time TEXT NOT NULL,
-                end_time TEXT NOT NULL,
-                is_logged INTEGER NOT NULL DEFAULT 0
-            )
-        """)
-        self.conn.commit()
+        self.migrate()
 
+    @timed("db.get_events_for_week")
     def get_events_for_week(self, start_of_week, end_of_week):
-        """Retrieves all events within a specific week."""
-        self.cursor.execute("""
-            SELECT * FROM events 
-            WHERE start_time BETWEEN ? AND ?
-        """, (start_of_week, end_of_week))
-        columns = [description[0] for description in self.cursor.description]
-        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+        """Retrieves all events within a specific week (served from the cache when possible)."""
+        key = (to_epoch(start_of_week), to_epoch(end_of_week))
+        events, generation = self._week_cache.get(key)
+        if events is None:
+            increment("db.week_cache.miss")
+            if self._archive_horizon is not None and key[0] <= self._archive_horizon:
+                # La settimana può contenere eventi archiviati: legge entrambi i file
+                # Gli eventi archiviati sono già loggati: nessun invio in coda
+                rows = self._query(f"""
+                    SELECT {EVENT_COLUMNS}, {OUTBOX_STATUS_COLUMN} FROM events
+                    WHERE start_ts BETWEEN ? AND ?
+                    UNION ALL
+                    SELECT {EVENT_COLUMNS}, NULL FROM archive.events WHERE start_ts BETWEEN ? AND ?
+                    ORDER BY start_ts
+                """, key + key)
+            else:
+                rows = self._query(f"""
+                    SELECT {EVENT_COLUMNS}, {OUTBOX_STATUS_COLUMN} FROM events
+                    WHERE start_ts BETWEEN ? AND ?
+                    ORDER BY start_ts
+                """, key)
+            events = [Event(*row) for row in rows]
+            self._week_cache.put(key, events, generation)
+        return list(events)
+
+    @timed("db.search_events")
+    def search_events(self, query, limit=20):
+        """Full-text search over names and descriptions, archived events included, best matches first.
+
+        Every word of ``query`` is matched as a prefix ("riun" finds
+        "riunione"); the ranking uses FTS5's bm25.
+        """
+        match = _fts_query(query)
+        if not match:
+            return []
+        # Eventi correnti e archiviati, ordinati insieme per rilevanza
+        rows = self._query("""
+            SELECT e.id, e.name, e.description, e.start_time, e.end_time, e.is_logged,
+                   e.start_ts, e.end_ts,
+                   (SELECT status FROM zoho_outbox o WHERE o.event_id = e.id), f.rank
+            FROM events_fts f
+            JOIN events e ON e.id = f.rowid
+            WHERE f.events_fts MATCH ?
+            UNION ALL
+            SELECT e.id, e.name, e.description, e.start_time, e.end_time, e.is_logged,
+                   e.start_ts, e.end_ts, NULL, f.rank
+            FROM archive.events_fts f
+            JOIN archive.events e ON e.id = f.rowid
+            WHERE f.events_fts MATCH ?
+            ORDER BY 10
+            LIMIT ?
+        """, (match, match, limit))
+        return [Event(*row[:-1]) for row in rows]
+
+    @timed("db.get_daily_hours")
+    def get_daily_hours(self, start_day, end_day):
+        """Returns {day: {"logged": hours, "unlogged": hours}} for 'YYYY-MM-DD' days, inclusive.
+
+        Reads the daily_hours rollup, so the cost depends on the number of
+        days in the range and not on the number of events.
+        """
+        rows = self._query("""
+            SELECT day, is_logged, seconds FROM daily_hours
+            WHERE day BETWEEN ? AND ?
+            ORDER BY day
+        """, (start_day, end_day))
+        days = {}
+        for day, is_logged, seconds in rows:
+            totals = days.setdefault(day, {"logged": 0.0, "unlogged": 0.0})
+            totals["logged" if is_logged else "unlogged"] += seconds / 3600
+        return days
+
+    @timed("db.get_hours_summary")
+    def get_hours_summary(self, start_day, end_day):
+        """Returns the total logged/unlogged hours between two 'YYYY-MM-DD' days, inclusive.
+
+        Results are cached and invalidated by the writes touching those days.
+        """
+        key = (to_epoch(f"{start_day} 00:00"), to_epoch(f"{end_day} 23:59:59"))
+        summary, generation = self._summary_cache.get(key)
+        if summary is not None:
+            return dict(summary)
+        rows = self._query("""
+            SELECT is_logged, SUM(seconds) FROM daily_hours
+            WHERE day BETWEEN ? AND ?
+            GROUP BY is_logged
+        """, (start_day, end_day))
+        summary = {"logged": 0.0, "unlogged": 0.0}
+        for is_logged, seconds in rows:
+            summary["logged" if is_logged else "unlogged"] = seconds / 3600
+        self._summary_cache.put(key, summary, generation)
+        return dict(summary)
 
     def add_event(self, name, description, start_time, end_time):
         """Adds a new event to the database."""
-        self.cursor.execute("""
-            INSERT INTO events (name, description, start_time, end_time)
-            VALUES (?, ?, ?, ?)
-        """, (name, description, start_time, end_time))
-        self.conn.commit()
-        return self.cursor.lastrowid
+        return self._write(self._insert_event, name, description, start_time, end_time)
+
+    def add_events(self, events, chunk_size=500):
+        """Bulk-inserts events in a single transaction.
+
+        ``events`` is any iterable (also a generator) of dicts with the keys
+        name, description, start_time, end_time and an optional ``source``
+        label used in reject reports. Rows are validated and written with
+        executemany in chunks of ``chunk_size``, so memory stays constant.
+        Returns (inserted_count, rejects) where rejects is a list of
+        (source, reason); invalid rows don't abort the batch.
+        """
+        return self._write(self._insert_events, events, chunk_size)
 
     def update_event(self, event_id, name, description, start_time, end_time):
         """Updates an existing event."""
-        self.cursor.execute("""
-            UPDATE events
-            SET name = ?, description = ?, start_time = ?, end_time = ?
-            WHERE id = ?
-        """, (name, description, start_time, end_time, event_id))
-        self.conn.commit()
+        return self._write(self._update_event, event_id, name, description, start_time, end_time)
 
     def delete_event(self, event_id):
         """Deletes an event from the database."""
-        self.cursor.execute("DELETE FROM events WHERE id = ?", (event_id,))
-        self.conn.commit()
+        return self._write(self._delete_event, event_id)
 
     def set_event_logged(self, event_id):
         """Marks an event as logged in the database."""
-        self.cursor.execute("UPDATE events SET is_logged = 1 WHERE id = ?", (event_id,))
-        self.conn.commit()
+        return self._write(self._set_event_logged, event_id)
+
+    # --- OUTBOX ZOHO ---
+
+    def enqueue_zoho_log(self, event_id, payload):
+        """Queues a Zoho time log for an event; the event shows as pending until sent.
+
+        ``payload`` holds the log_time_to_zoho arguments except portal and
+        owner, which are resolved when the log is sent. Queueing an event
+        that is already in the outbox replaces its entry with a new
+        idempotency key. Returns the idempotency key.
+        """
+        return self._write(self._enqueue_outbox, event_id, json.dumps(payload),
+                           uuid.uuid4().hex, time.time())
+
+    def enqueue_zoho_logs(self, logs):
+        """Queues several (event_id, payload) time logs in a single transaction.
+
+        Same semantics as enqueue_zoho_log; returns the idempotency keys in order.
+        """
+        entries = [(event_id, json.dumps(payload), uuid.uuid4().hex) for event_id, payload in logs]
+        return self._write(self._enqueue_outbox_many, entries, time.time())
+
+    @timed("db.get_due_zoho_logs")
+    def get_due_zoho_logs(self, now=None, limit=20):
+        """Returns pending outbox entries whose next attempt is due, oldest first.
+
+        Each entry is a dict with id, event_id, idempotency_key, payload,
+        attempts (rejections by Zoho) and retries (transient failures).
+        """
+        rows = self._query("""
+            SELECT id, event_id, idempotency_key, payload, attempts, retries FROM zoho_outbox
+            WHERE status = 'pending' AND next_attempt_ts <= ?
+            ORDER BY next_attempt_ts
+            LIMIT ?
+        """, (now if now is not None else time.time(), limit))
+        return [{"id": row[0], "event_id": row[1], "idempotency_key": row[2],
+                 "payload": json.loads(row[3]), "attempts": row[4], "retries": row[5]}
+                for row in rows]
+
+    @timed("db.next_zoho_log_due")
+    def next_zoho_log_due(self):
+        """Returns the epoch time of the next pending attempt, or None if nothing is pending."""
+        return self._query(
+            "SELECT MIN(next_attempt_ts) FROM zoho_outbox WHERE status = 'pending'")[0][0]
+
+    def complete_zoho_logs(self, sent):
+        """Removes the sent (outbox_id, event_id) entries and marks their events as logged.
+
+        Everything happens in a single transaction.
+        """
+        return self._write(self._complete_outbox, list(sent))
+
+    def retry_zoho_log(self, outbox_id, error, next_attempt_ts=None, transient=False):
+        """Records a failed attempt; without next_attempt_ts the entry is marked failed.
+
+        A transient failure increments retries instead of attempts.
+        """
+        return self._write(self._reschedule_outbox, outbox_id, error, next_attempt_ts, transient)
+
+    # --- OPERAZIONI DI SCRITTURA (eseguite sul cursore del writer) ---
+
+    @staticmethod
+    def _insert_event(cursor, touched, name, description, start_time, end_time):
+        start_ts = to_epoch(start_time)
+        end_ts = to_epoch(end_time)
+        cursor.execute("""
+            INSERT INTO events (name, description, start_time, end_time, start_ts, end_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (name, description, start_time, end_time, start_ts, end_ts))
+        touched.append((start_ts, start_ts))
+        _adjust_rollup(cursor, [(_day_of(start_ts), 0, end_ts - start_ts)])
+        return cursor.lastrowid
+
+    @staticmethod
+    def _insert_events(cursor, touched, events, chunk_size):
+        inserted = 0
+        rejects = []
+        chunk = []
+
+        def flush():
+            nonlocal inserted
+            cursor.executemany("""
+                INSERT INTO events (name, description, start_time, end_time, start_ts, end_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, chunk)
+            inserted += len(chunk)
+            touched.append((min(row[4] for row in chunk), max(row[4] for row in chunk)))
+            per_day = {}
+            for row in chunk:
+                day = _day_of(row[4])
+                per_day[day] = per_day.get(day, 0) + row[5] - row[4]
+            _adjust_rollup(cursor, [(day, 0, seconds) for day, seconds in per_day.items()])
+            chunk.clear()
+
+        for position, event in enumerate(events, start=1):
+            source = event.get("source", position)
+            try:
+                row = _validate_event(event)
+            except ValueError as e:
+                rejects.append((source, str(e)))
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+        return inserted, rejects
+
+    @staticmethod
+    def _update_event(cursor, touched, event_id, name, description, start_time, end_time):
+        row = _touch_event(cursor, touched, event_id)
+        if row is None:
+            return
+        start_ts = to_epoch(start_time)
+        end_ts = to_epoch(end_time)
+        cursor.execute("""
+            UPDATE events
+            SET name = ?, description = ?, start_time = ?, end_time = ?,
+                start_ts = ?, end_ts = ?
+            WHERE id = ?
+        """, (name, description, start_time, end_time, start_ts, end_ts, event_id))
+        touched.append((start_ts, start_ts))
+        _adjust_rollup(cursor, [(_day_of(start_ts), row[2], end_ts - start_ts)])
+
+    @staticmethod
+    def _delete_event(cursor, touched, event_id):
+        _touch_event(cursor, touched, event_id)
+        cursor.execute("DELETE FROM zoho_outbox WHERE event_id = ?", (event_id,))
+        cursor.execute("DELETE FROM events WHERE id = ?", (event_id,))
+        cursor.execute("DELETE FROM archive.events WHERE id = ?", (event_id,))
+
+    @staticmethod
+    def _set_event_logged(cursor, touched, event_id):
+        row = _touch_event(cursor, touched, event_id)
+        if row is None:
+            return
+        cursor.execute("UPDATE events SET is_logged = 1 WHERE id = ?", (event_id,))
+        start_ts, end_ts, _ = row
+        _adjust_rollup(cursor, [(_day_of(start_ts), 1, end_ts - start_ts)])
+
+    @staticmethod
+    def _set_events_logged(cursor, touched, event_ids):
+        for event_id in event_ids:
+            Database._set_event_logged(cursor, touched, event_id)
+
+    @staticmethod
+    def _touch_outbox_event(cursor, touched, event_id):
+        # Lo stato dell'outbox compare negli eventi in cache: invalida la settimana
+        cursor.execute("SELECT start_ts FROM events WHERE id = ?", (event_id,))
+        row = cursor.fetchone()
+        if row:
+            touched.append((row[0], row[0]))
+
+    @staticmethod
+    def _enqueue_outbox(cursor, touched, event_id, payload, idempotency_key, now):
+        cursor.execute("""
+            INSERT INTO zoho_outbox (event_id, idempotency_key, payload, next_attempt_ts, created_ts)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (event_id) DO UPDATE SET
+                idempotency_key = excluded.idempotency_key, payload = excluded.payload,
+                status = 'pending', attempts = 0, retries = 0, last_error = NULL,
+                next_attempt_ts = excluded.next_attempt_ts
+        """, (event_id, idempotency_key, payload, now, now))
+        Database._touch_outbox_event(cursor, touched, event_id)
+        return idempotency_key
+
+    @staticmethod
+    def _enqueue_outbox_many(cursor, touched, entries, now):
+        return [Database._enqueue_outbox(cursor, touched, event_id, payload, key, now)
+                for event_id, payload, key in entries]
+
+    @staticmethod
+    def _complete_outbox(cursor, touched, sent):
+        cursor.executemany("DELETE FROM zoho_outbox WHERE id = ?",
+                           [(outbox_id,) for outbox_id, _ in sent])
+        Database._set_events_logged(cursor, touched, [event_id for _, event_id in sent])
+
+    @staticmethod
+    def _reschedule_outbox(cursor, touched, outbox_id, error, next_attempt_ts, transient):
+        cursor.execute("""
+            UPDATE zoho_outbox
+            SET attempts = attempts + ?, retries = retries + ?, last_error = ?, next_attempt_ts = ?,
+                status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'pending' END
+            WHERE id = ?
+        """, (0 if transient else 1, 1 if transient else 0, error, next_attempt_ts,
+              next_attempt_ts, outbox_id))
+        cursor.execute("SELECT event_id FROM zoho_outbox WHERE id = ?", (outbox_id,))
+        row = cursor.fetchone()
+        if row:
+            Database._touch_outbox_event(cursor, touched, row[0])
+
+    @staticmethod
+    def _archive_batch(cursor, touched, cutoff_ts, batch_size):
+        # Il rollup daily_hours non cambia: gli eventi vengono spostati, non cancellati
+        cursor.execute("""
+            SELECT id FROM events
+            WHERE is_logged = 1 AND end_ts < ?
+            LIMIT ?
+        """, (cutoff_ts, batch_size))
+        ids = [(row[0],) for row in cursor.fetchall()]
+        cursor.executemany(f"""
+            INSERT INTO archive.events ({EVENT_COLUMNS})
+            SELECT {EVENT_COLUMNS} FROM events WHERE id = ?
+        """, ids)
+        cursor.executemany("DELETE FROM events WHERE id = ?", ids)
+        cursor.execute("SELECT MAX(start_ts) FROM archive.events")
+        return len(ids), cursor.fetchone()[0]
+
+    def archive_logged_events(self, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=1000):
+        """Moves logged events that ended more than older_than_days ago to the archive.
+
+        Works in batches of ``batch_size`` rows, one transaction each, so the
+        writer is never blocked for long. Blocks until done (also in WAL mode)
+        and returns the number of archived events.
+        """
+        cutoff_ts = to_epoch(datetime.now()) - older_than_days * 86400
+        archived = 0
+        while True:
+            result = self._write(self._archive_batch, cutoff_ts, batch_size)
+            if isinstance(result, Future):
+                result = result.result()
+            moved, horizon = result
+            self._archive_horizon = horizon
+            archived += moved
+            if moved < batch_size:
+                return archived
+
+    @staticmethod
+    def _compact(cursor, archived):
+        """Optimizes and compacts the schemas that changed; returns the ones vacuumed.
+
+        The archive is only indexed again when rows were moved into it, and a
+        file is rewritten by VACUUM only when archiving freed pages in it or
+        it has at least VACUUM_MIN_FREE_PAGES free pages.
+        """
+        # Fuori da ogni transazione: VACUUM non può stare in un BEGIN
+        changed = ("main", "archive") if archived else ("main",)
+        for schema in changed:
+            cursor.execute(f"INSERT INTO {schema}.events_fts (events_fts) VALUES ('optimize')")
+        if cursor.connection.in_transaction:
+            # Senza WAL il modulo sqlite3 apre da solo una transazione prima dell'INSERT
+            cursor.connection.commit()
+        cursor.execute("PRAGMA main.optimize")
+        for schema in changed:
+            cursor.execute(f"ANALYZE {schema}")
+        vacuumed = []
+        for schema in ("main", "archive"):
+            free_pages = cursor.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+            if (archived and schema == "main") or free_pages >= VACUUM_MIN_FREE_PAGES:
+                cursor.execute(f"VACUUM {schema}")
+                vacuumed.append(schema)
+        return vacuumed
+
+    def run_maintenance(self, older_than_days=ARCHIVE_AFTER_DAYS):
+        """Archives old logged events, then runs ANALYZE and VACUUM where needed (see _compact).
+
+        Meant to be called periodically from a background thread. In WAL mode
+        the compaction runs on the batched writer, between two batches, so
+        queued writes wait for it instead of failing. Returns the number of
+        archived events, or None if a previous run is still in progress.
+        """
+        if not self._maintenance_lock.acquire(blocking=False):
+            logger.info("Manutenzione database già in corso: esecuzione saltata.")
+            return None
+        try:
+            archived = self.archive_logged_events(older_than_days)
+            if self._writer is not None:
+                vacuumed = self._writer.submit(self._compact, archived, transaction=False).result()
+            else:
+                with self._connections.writer() as conn:
+                    vacuumed = self._compact(conn.cursor(), archived)
+            logger.info("Manutenzione database completata: %d eventi archiviati, VACUUM su %s.",
+                        archived, ", ".join(vacuumed) or "nessun file")
+            return archived
+        finally:
+            self._maintenance_lock.release()
+
+    def close(self):
+        """Flushes pending writes and closes the connections."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._connections.close()
 
     def __del__(self):
-        self.conn.close()
+        if getattr(self, "_connections", None) is not None:
+            self.close()
@@ -0,0 +1,146 @@
+import csv
+import os
+import re
+import sys
+from datetime import datetime, timezone
+
+# Formato usato dall'app per salvare le date degli eventi
+EVENT_DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+
+# --- CSV ---
+
+
+def iter_csv_events(path):
+    """Yields event dicts from a CSV file, one row at a time.
+
+    The header must contain name, start_time and end_time (description is
+    optional); dates use the 'YYYY-MM-DD HH:MM' format. Validation is left to
+    Database.add_events, which reports bad rows by their line number.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield {
+                "source": f"riga {reader.line_num}",
+                "name": row.get("name"),
+                "description": row.get("description"),
+                "start_time": row.get("start_time"),
+                "end_time": row.get("end_time"),
+            }
+
+# --- ICS ---
+
+
+def _unfold_lines(f):
+    """Joins RFC 5545 folded lines (continuations start with a space or tab)."""
+    current = None
+    current_line = 0
+    for line_num, raw in enumerate(f, start=1):
+        line = raw.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current_line, current
+        current, current_line = line, line_num
+    if current is not None:
+        yield current_line, current
+
+
+# Escape dei valori TEXT ICS, risolti in un solo passaggio: con replace in
+# sequenza \\n (backslash letterale + n) diventerebbe un a capo
+_TEXT_ESCAPE = re.compile(r"\\([\\;,nN])")
+
+
+def _unescape_text(value):
+    return _TEXT_ESCAPE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _parse_ics_datetime(params, value):
+    """Converts a DTSTART/DTEND value to the app format, or returns it unchanged.
+
+    UTC values (trailing 'Z') are converted to local time; values with a TZID
+    or floating times are taken as wall-clock time. All-day dates start at 00:00.
+    """
+    try:
+        if "VALUE=DATE" in params or len(value) == 8:
+            dt = datetime.strptime(value, "%Y%m%d")
+        elif value.endswith("Z"):
+            dt = datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(
+                tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+        else:
+            dt = datetime.strptime(value, "%Y%m%dT%H%M%S")
+    except ValueError:
+        return value
+    return dt.strftime(EVENT_DATETIME_FORMAT)
+
+
+def iter_ics_events(path):
+    """Yields event dicts from the VEVENT blocks of an iCalendar file.
+
+    The file is read line by line, so only the event being parsed is kept in
+    memory. Unparsable dates are passed through as-is and rejected later by
+    Database.add_events.
+    """
+    with open(path, encoding="utf-8-sig") as f:
+        event = None
+        for line_num, line in _unfold_lines(f):
+            if line == "BEGIN:VEVENT":
+                event = {"source": f"riga {line_num}", "name": None,
+                         "description": None, "start_time": None, "end_time": None}
+                continue
+            if event is None:
+                continue
+            if line == "END:VEVENT":
+                yield event
+                event = None
+                continue
+            key, sep, value = line.partition(":")
+            if not sep:
+                continue
+            prop, _, params = key.partition(";")
+            prop = prop.upper()
+            if prop == "SUMMARY":
+                event["name"] = _unescape_text(value)
+            elif prop == "DESCRIPTION":
+                event["description"] = _unescape_text(value)
+            elif prop == "DTSTART":
+                event["start_time"] = _parse_ics_datetime(params.upper(), value)
+            elif prop == "DTEND":
+                event["end_time"] = _parse_ics_datetime(params.upper(), value)
+
+# --- IMPORT ---
+
+
+def iter_file_events(path):
+    """Picks the parser from the file extension (.ics or .csv)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".ics":
+        return iter_ics_events(path)
+    if extension == ".csv":
+        return iter_csv_events(path)
+    raise ValueError(f"Formato file non supportato: {extension}")
+
+
+def import_events(db, path, chunk_size=500):
+    """Streams an ICS/CSV file into the database with Database.add_events.
+
+    Returns (inserted_count, rejects), or a Future resolving to it when the
+    database runs in WAL mode.
+    """
+    return db.add_events(iter_file_events(path), chunk_size=chunk_size)
+
+
+if __name__ == "__main__":
+    # Uso: python -m calendar_logger.importer file.ics|file.csv [events.db]
+    from calendar_logger.database import Database
+
+    if len(sys.argv) < 2:
+        print("Uso: python -m calendar_logger.importer <file.ics|file.csv> [database]")
+        sys.exit(1)
+    database = Database(sys.argv[2] if len(sys.argv) > 2 else "events.db")
+    database.migrate()
+    inserted, rejects = import_events(database, sys.argv[1])
+    print(f"Eventi importati: {inserted}, scartati: {len(rejects)}")
+    for source, reason in rejects:
+        print(f"- {source}: {reason}")
@@ -0,0 +1,210 @@
+import bisect
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# --- LOGGING ---
+# I moduli scrivono su logger figli di "calendar_logger". Il debug è spento
+# di default: si attiva con CALENDAR_LOGGER_DEBUG=1 o configure_logging("DEBUG").
+LOGGER_NAME = "calendar_logger"
+DEBUG_ENV = "CALENDAR_LOGGER_DEBUG"
+# Se impostata, all'uscita le metriche vengono esportate in questo file JSON
+METRICS_ENV = "CALENDAR_LOGGER_METRICS"
+
+_SECRET_PATTERNS = (
+    re.compile(r"(Zoho-oauthtoken\s+)([^\s'\"]+)"),
+    re.compile(r"((?:access_token|refresh_token|client_secret)['\"]?\s*[:=]\s*['\"]?)([^\s'\"&,}]+)"),
+)
+
+
+def redact(text):
+    """Masks tokens and client secrets in a string, keeping their last 4 characters."""
+    for pattern in _SECRET_PATTERNS:
+        text = pattern.sub(lambda m: m.group(1) + "***" + m.group(2)[-4:], text)
+    return text
+
+
+class RedactingFilter(logging.Filter):
+    """Removes secrets from the formatted message of every record."""
+
+    def filter(self, record):
+        message = record.getMessage()
+        clean = redact(message)
+        if clean != message:
+            record.msg, record.args = clean, None
+        return True
+
+
+_redacting_filter = RedactingFilter()
+
+
+def get_logger(name):
+    """Returns the logger for a module of the package, with secret redaction."""
+    logger = logging.getLogger(name)
+    if _redacting_filter not in logger.filters:
+        logger.addFilter(_redacting_filter)
+    return logger
+
+
+def configure_logging(level=None, stream=None):
+    """Sends the package logs to stderr (or stream) at ``level``.
+
+    Without a level, DEBUG is used if CALENDAR_LOGGER_DEBUG is set, else INFO.
+    """
+    if level is None:
+        level = logging.DEBUG if os.environ.get(DEBUG_ENV) else logging.INFO
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    if not any(getattr(h, "_calendar_logger", False) for h in logger.handlers):
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handler.addFilter(_redacting_filter)
+        handler._calendar_logger = True
+        logger.addHandler(handler)
+
+
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+
+# --- METRICHE ---
+# Limiti superiori (ms) dei bucket degli istogrammi; l'ultimo bucket è aperto
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                       1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Latency distribution in fixed buckets, with count, total, min and max."""
+
+    def __init__(self, bounds=HISTOGRAM_BOUNDS_MS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, ms):
+        self.buckets[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples (capped at max)."""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                value = min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                return round(value, 3)
+        return round(self.max, 3)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "avg_ms": round(self.total / self.count, 3) if self.count else None,
+            "min_ms": round(self.min, 3) if self.count else None,
+            "max_ms": round(self.max, 3) if self.count else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": {f"<={bound}" if i < len(self.bounds) else f">{self.bounds[-1]}": n
+                        for i, (bound, n) in enumerate(zip(self.bounds + (None,), self.buckets))
+                        if n},
+        }
+
+
+class Metrics:
+    """Named timers (latency histograms) and counters, safe to use from any thread."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._timers = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, ms):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._timers.get(name)
+            if histogram is None:
+                histogram = self._timers[name] = Histogram()
+            histogram.record(ms)
+
+    def increment(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name):
+        """Records the duration of the with-block (also when it raises) under ``name``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def timed(self, name):
+        """Decorator timing every call of a function under ``name``."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Returns {"timers": {name: histogram dict}, "counters": {name: n}}."""
+        with self._lock:
+            return {
+                "timers": {name: h.to_dict() for name, h in sorted(self._timers.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def report(self, width=30):
+        """Text dump of every histogram (one bar per bucket) and counter."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, h in snapshot["timers"].items():
+            lines.append(f"{name}: n={h['count']} avg={h['avg_ms']:.2f}ms p50={h['p50_ms']:.2f}ms "
+                         f"p95={h['p95_ms']:.2f}ms p99={h['p99_ms']:.2f}ms max={h['max_ms']:.2f}ms")
+            peak = max(h["buckets"].values())
+            for bucket, n in h["buckets"].items():
+                bar = "#" * max(1, round(n / peak * width))
+                lines.append(f"  {bucket:>8} ms {bar} {n}")
+        if snapshot["counters"]:
+            lines.append("Contatori:")
+            lines.extend(f"  {name}: {n}" for name, n in snapshot["counters"].items())
+        return "\n".join(lines)
+
+    def export(self, path):
+        """Writes the snapshot as JSON (atomically) for offline profiling."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.snapshot(), exported_at=time.time()), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+timer = metrics.timer
+timed = metrics.timed
+increment = metrics.increment
@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+from calendar_logger import settings_manager, zoho_api
+from calendar_logger.instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+# Rifiuti di Zoho (4xx diversi da 401/429) prima di segnare un invio come fallito.
+# Rete assente, timeout e owner non risolto non consumano tentativi: si ritenta
+# con backoff esponenziale fino a RETRY_MAX_DELAY, senza limite
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 3600
+# La coda viene ricontrollata almeno con questo intervallo (secondi)
+IDLE_INTERVAL = 60
+
+
+def _wait(result):
+    # In WAL il Database restituisce una Future
+    return result.result() if isinstance(result, Future) else result
+
+
+def retry_delay(attempts):
+    """Seconds to wait after the given number of failures, with up to +50% jitter,
+    capped at RETRY_MAX_DELAY."""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (min(attempts, 32) - 1))
+    return min(RETRY_MAX_DELAY, delay + random.uniform(0, delay / 2))
+
+
+class OutboxWorker(threading.Thread):
+    """Background thread sending the Zoho time logs queued in the database outbox.
+
+    Due entries go out oldest first through log_times_to_zoho (owner resolved
+    once, LOG_BATCH_CONCURRENCY at a time), each with its idempotency key.
+    The sent entries are removed and their events marked as logged in one
+    transaction;
+    failures are retried with backoff. Only rejections by Zoho count against
+    MAX_ATTEMPTS, after which the entry is marked failed until the user logs
+    the event again; while offline (or when the owner cannot be resolved)
+    entries are rescheduled indefinitely, at most RETRY_MAX_DELAY apart.
+
+    ``notify()`` wakes the worker after an enqueue. ``on_change`` is called
+    (from the worker thread) after a drain that sent or rescheduled entries.
+    """
+
+    def __init__(self, db, on_change=None):
+        super().__init__(name="zoho-outbox", daemon=True)
+        self.db = db
+        self.on_change = on_change
+        self._wakeup = threading.Event()
+        self._stopping = False
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=5):
+        """Stops the thread after the entry being sent; what is left stays queued."""
+        self._stopping = True
+        self._wakeup.set()
+        self.join(timeout)
+
+    def run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                if self.drain() and self.on_change is not None:
+                    self.on_change()
+            except Exception as e:
+                logger.exception("Outbox: errore durante l'invio: %s", e)
+            next_due = self.db.next_zoho_log_due()
+            timeout = IDLE_INTERVAL
+            if next_due is not None:
+                timeout = min(IDLE_INTERVAL, max(0, next_due - time.time()))
+            self._wakeup.wait(timeout)
+
+    def drain(self):
+        """Sends the entries that are due; returns True if any entry changed state."""
+        entries = self.db.get_due_zoho_logs()
+        if not entries:
+            return False
+        portal_id = settings_manager.get_credentials().get("portal_id")
+        # Owner risolto una volta e invii in parallelo: il batch di log_times_to_zoho
+        results = zoho_api.log_times_to_zoho(
+            portal_id, [dict(entry["payload"], idempotency_key=entry["idempotency_key"])
+                        for entry in entries])
+        sent = [(entry["id"], entry["event_id"])
+                for entry, result in zip(entries, results) if result["success"]]
+        if sent:
+            _wait(self.db.complete_zoho_logs(sent))
+        for entry, result in zip(entries, results):
+            if result["success"]:
+                continue
+            if not result["rejected"]:
+                # Errore transitorio: si ritenta più tardi senza consumare i tentativi
+                retries = entry["retries"] + 1
+                logger.info("Outbox: invio evento %s rimandato (%d): %s",
+                            entry['event_id'], retries, result['message'])
+                _wait(self.db.retry_zoho_log(entry["id"], result["message"],
+                                             time.time() + retry_delay(retries), transient=True))
+                continue
+            attempts = entry["attempts"] + 1
+            next_attempt_ts = time.time() + retry_delay(attempts) if attempts < MAX_ATTEMPTS else None
+            logger.warning("Outbox: invio evento %s rifiutato da Zoho (%d/%d): %s",
+                           entry['event_id'], attempts, MAX_ATTEMPTS, result['message'])
+            _wait(self.db.retry_zoho_log(entry["id"], result["message"], next_attempt_ts))
+        return True
@@ -1,52 +1,218 @@
+import json
+import os
+import threading
+from types import MappingProxyType
 import keyring
+from keyring.errors import PasswordDeleteError
+from calendar_logger.instrumentation import get_logger
+
+logger = get_logger(__name__)
 
 SERVICE_NAME = "GeminiZohoCalendarApp"
 
+CREDENTIAL_KEYS = ("client_id", "client_secret", "refresh_token", "api_domain", "portal_id", "email")
+
+# --- FORMATO DI SALVATAGGIO ---
+# Tutte le impostazioni stanno in un unico segreto JSON nel keyring, letto e
+# scritto con una sola chiamata. Le ore del calendario non sono segrete e, se
+# CONFIG_PATH è impostato, vengono salvate in un file di configurazione locale.
+SETTINGS_ENTRY = "settings"
+SETTINGS_VERSION = 1
+CONFIG_PATH = "calendar_settings.json"
+# Layout precedente: una voce del keyring per ogni impostazione
+LEGACY_KEYS = CREDENTIAL_KEYS + ("access_token", "access_token_expiry",
+                                 "calendar_start_hour", "calendar_end_hour")
+
+_store = None
+_store_lock = threading.RLock()
+
+
+def _empty_store():
+    return {"version": SETTINGS_VERSION, "credentials": {}, "access_token": None,
+            "access_token_expiry": None, "calendar_hours": {}}
+
+
+def _migrate_legacy():
+    """Builds the store from the per-key entries of older versions, then removes them."""
+    legacy = {key: keyring.get_password(SERVICE_NAME, key) for key in LEGACY_KEYS}
+    store = _empty_store()
+    if not any(legacy.values()):
+        # Prima installazione: la voce vuota evita di ricontrollare il vecchio layout
+        _write_store(store)
+        return store
+    store["credentials"] = {key: legacy[key] for key in CREDENTIAL_KEYS}
+    store["access_token"] = legacy["access_token"]
+    try:
+        store["access_token_expiry"] = float(legacy["access_token_expiry"] or "")
+    except ValueError:
+        pass
+    hours = {"start_hour": legacy["calendar_start_hour"], "end_hour": legacy["calendar_end_hour"]}
+    hours = {key: value for key, value in hours.items() if value}
+    if CONFIG_PATH and hours:
+        _write_config(dict(_read_config(), calendar_hours=hours))
+    elif hours:
+        store["calendar_hours"] = hours
+    _write_store(store)
+    for key, value in legacy.items():
+        if value is not None:
+            try:
+                keyring.delete_password(SERVICE_NAME, key)
+            except PasswordDeleteError:
+                pass
+    logger.info("Impostazioni migrate al nuovo formato.")
+    return store
+
+
+def _load_store():
+    """Returns the settings store, reading the keyring (or migrating) on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            raw = keyring.get_password(SERVICE_NAME, SETTINGS_ENTRY)
+            if raw is None:
+                _store = _migrate_legacy()
+            else:
+                store = json.loads(raw)
+                if store.get("version", 0) > SETTINGS_VERSION:
+                    raise ValueError(
+                        f"Formato impostazioni {store['version']} non supportato")
+                _store = dict(_empty_store(), **store)
+        return _store
+
+
+def _write_store(store):
+    global _store
+    with _store_lock:
+        keyring.set_password(SERVICE_NAME, SETTINGS_ENTRY, json.dumps(store))
+        _store = store
+
+
+def _update_store(**changes):
+    with _store_lock:
+        store = dict(_load_store(), **changes)
+        _write_store(store)
+
+
+def _read_config():
+    if not CONFIG_PATH or not os.path.exists(CONFIG_PATH):
+        return {}
+    with open(CONFIG_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_config(config):
+    # Scrittura atomica: il file non resta mai a metà
+    tmp_path = f"{CONFIG_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, CONFIG_PATH)
+
+# --- SNAPSHOT ---
+# Le impostazioni vengono lette una sola volta e tenute in memoria come
+# mapping di sola lettura; le funzioni save/clear le invalidano.
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+_subscribers = []
+
+
+def _snapshot(kind, load):
+    with _snapshot_lock:
+        snapshot = _snapshots.get(kind)
+        if snapshot is None:
+            snapshot = _snapshots[kind] = MappingProxyType(load())
+        return snapshot
+
+
+def _invalidate(*kinds):
+    """Drops the cached snapshots and notifies subscribers of those that changed."""
+    with _snapshot_lock:
+        old = {kind: _snapshots.pop(kind, None) for kind in kinds}
+    for kind in kinds:
+        if old[kind] is None:
+            # Nessuno l'aveva ancora letto: nessuno può avere valori vecchi
+            continue
+        new = get_credentials() if kind == "credentials" else get_calendar_hours()
+        if dict(old[kind]) != dict(new):
+            for callback in list(_subscribers):
+                callback(kind, old[kind], new)
+
+
+def subscribe(callback):
+    """Registers callback(kind, old, new), called when saved settings change.
+
+    kind is "credentials" or "calendar_hours". Callbacks run on the thread
+    that saved the settings. Returns a function that removes the callback.
+    """
+    _subscribers.append(callback)
+    return lambda: _subscribers.remove(callback)
+
+# --- CREDENZIALI ---
+
+
 def save_credentials(client_id, client_secret, refresh_token, api_domain, portal_id, email):
     """Saves Zoho credentials securely in the system's keyring."""
-    keyring.set_password(SERVICE_NAME, "client_id", client_id)
-    keyring.set_password(SERVICE_NAME, "client_secret", client_secret)
-    keyring.set_password(SERVICE_NAME, "refresh_token", refresh_token)
-    keyring.set_password(SERVICE_NAME, "api_domain", api_domain)
-    keyring.set_password(SERVICE_NAME, "portal_id", portal_id)
-    keyring.set_password(SERVICE_NAME, "email", email)
-    print("Credenziali salvate con successo.")
+    _update_store(credentials={
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "refresh_token": refresh_token,
+        "api_domain": api_domain,
+        "portal_id": portal_id,
+        "email": email,
+    })
+    _invalidate("credentials")
+    logger.info("Credenziali salvate con successo.")
 
 def get_credentials():
-    """Retrieves Zoho credentials from the system's keyring."""
-    return {
-        "client_id": keyring.get_password(SERVICE_NAME, "client_id"),
-        "client_secret": keyring.get_password(SERVICE_NAME, "client_secret"),
-        "refresh_token": keyring.get_password(SERVICE_NAME, "refresh_token"),
-        "api_domain": keyring.get_password(SERVICE_NAME, "api_domain"),
-        "portal_id": keyring.get_password(SERVICE_NAME, "portal_id"),
-        "email": keyring.get_password(SERVICE_NAME, "email"),
-    }
-
-def save_access_token(access_token):
-    """Saves the access token. For simplicity, we save it to the keyring as well."""
-    keyring.set_password(SERVICE_NAME, "access_token", access_token)
+    """Returns Zoho credentials as a read-only mapping, read from the keyring once."""
+    return _snapshot("credentials", lambda: {
+        key: _load_store()["credentials"].get(key) for key in CREDENTIAL_KEYS})
+
+def save_access_token(access_token, expires_at=None):
+    """Saves the access token (and its expiry, as epoch seconds) to the keyring."""
+    _update_store(access_token=access_token, access_token_expiry=expires_at)
 
 def get_access_token():
     """Retrieves the access token."""
-    return keyring.get_password(SERVICE_NAME, "access_token")
+    return _load_store()["access_token"]
+
+def get_access_token_expiry():
+    """Retrieves the access token expiry as epoch seconds, or None if unknown."""
+    return _load_store()["access_token_expiry"]
 
 def save_calendar_hours(start_hour, end_hour):
-    """Saves calendar start and end hours to the keyring."""
-    keyring.set_password(SERVICE_NAME, "calendar_start_hour", str(start_hour))
-    keyring.set_password(SERVICE_NAME, "calendar_end_hour", str(end_hour))
+    """Saves calendar start and end hours to the config file (or the keyring)."""
+    hours = {"start_hour": str(start_hour), "end_hour": str(end_hour)}
+    if CONFIG_PATH:
+        _write_config(dict(_read_config(), calendar_hours=hours))
+    else:
+        _update_store(calendar_hours=hours)
+    _invalidate("calendar_hours")
 
 def get_calendar_hours():
-    """Retrieves calendar hours, returning defaults if not set."""
-    start = keyring.get_password(SERVICE_NAME, "calendar_start_hour")
-    end = keyring.get_password(SERVICE_NAME, "calendar_end_hour")
-    return {
-        "start_hour": start if start else "8",
-        "end_hour": end if end else "19",
-    }
-    
+    """Retrieves calendar hours (read-only mapping), returning defaults if not set."""
+    def load():
+        if CONFIG_PATH:
+            # Il keyring va comunque letto: l'eventuale migrazione scrive il file
+            _load_store()
+            hours = _read_config().get("calendar_hours", {})
+        else:
+            hours = _load_store()["calendar_hours"]
+        return {
+            "start_hour": hours.get("start_hour") or "8",
+            "end_hour": hours.get("end_hour") or "19",
+        }
+    return _snapshot("calendar_hours", load)
+
 def clear_credentials():
     """Clears all stored credentials and tokens."""
-    for key in ["client_id", "client_secret", "refresh_token", "api_domain", "portal_id", "email", "access_token", "calendar_start_hour", "calendar_end_hour"]:
-        keyring.delete_password(SERVICE_NAME, key)
-    print("Credenziali cancellate con successo.")
+    global _store
+    with _store_lock:
+        try:
+            keyring.delete_password(SERVICE_NAME, SETTINGS_ENTRY)
+        except PasswordDeleteError:
+            pass
+        _store = _empty_store()
+        if CONFIG_PATH and os.path.exists(CONFIG_PATH):
+            os.remove(CONFIG_PATH)
+    _invalidate("credentials", "calendar_hours")
+    logger.info("Credenziali cancellate con successo.")
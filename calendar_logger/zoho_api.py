@@ -1,179 +1,885 @@
+import queue
+import random
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from calendar_logger import settings_manager
+from calendar_logger.instrumentation import get_logger, increment, metrics, timer
+from calendar_logger.zoho_cache import DiskCache, SingleFlightCache
+from calendar_logger.zoho_ratelimit import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, RequestScheduler)
 from concurrent.futures import ThreadPoolExecutor
 import time
 
-# --- CACHE IN MEMORIA ---
-_cache = {
-    "projects": {},
-    "tasks": {},
-    "users": None,
-    "access_token": None,
-    "token_expiry": 0
+TOKEN_URL = "https://accounts.zoho.com/oauth/v2/token"
+
+logger = get_logger(__name__)
+
+# --- CONFIGURAZIONE HTTP ---
+# Thread usati da get_all_tasks_parallel
+MAX_WORKERS = 5
+# Pagine richieste in parallelo dopo la prima, su un executor condiviso da tutti gli elenchi
+PAGE_CONCURRENCY = 4
+# Timeout (connessione, lettura) in secondi per ogni richiesta
+REQUEST_TIMEOUT = (5, 30)
+# Tentativi per errori di connessione e risposte 5xx, con backoff esponenziale
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# --- LIMITI DI RICHIESTE ---
+# Limite per utente condiviso da tutti gli endpoint (richieste, periodo in
+# secondi): la priorità delle richieste vale su questa quota comune
+GLOBAL_QUOTA = (100, 120)
+# Endpoint fuori dalla quota comune (il token è servito dal server accounts)
+GLOBAL_EXEMPT = ("token",)
+# Tetti aggiuntivi per endpoint. Gli endpoint non elencati usano DEFAULT_QUOTA.
+API_QUOTAS = {
+    "projects": (100, 120),
+    "tasks": (100, 120),
+    "users": (100, 120),
+    "log": (100, 120),
+    "token": (10, 60),
 }
+DEFAULT_QUOTA = (100, 120)
+# Nuovi tentativi dopo una risposta 429, prima di restituire l'errore
+RATE_LIMIT_RETRIES = 3
+
+# --- CACHE ---
+# Dopo il TTL (secondi) una voce è "stale": in memoria viene scartata, su
+# disco viene restituita subito e aggiornata in background.
+CACHE_TTL = {
+    "projects": 6 * 3600,
+    "tasks": 3600,
+    "users": 24 * 3600,
+}
+# Cache in memoria: LRU limitata, con una sola richiesta in volo per chiave
+_memory_cache = SingleFlightCache(maxsize=1024)
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def _get_disk_cache():
+    global _disk_cache
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            _disk_cache = DiskCache()
+        return _disk_cache
+
+
+def _store(cache_key, value):
+    fetched_at = time.time()
+    _memory_cache.put(cache_key, value, fetched_at)
+    _get_disk_cache().set(cache_key, value, fetched_at)
+
+
+def _fetch_and_store(cache_key, fetch):
+    value, error = fetch()
+    if not error:
+        _store(cache_key, value)
+    return value, error
+
+
+def _revalidate(cache_key, fetch):
+    """Refreshes a stale entry in a background thread (once per key)."""
+    # Chiave di volo distinta: _revalidate parte dall'interno del load di cache_key
+    flight_key = f"{cache_key}#revalidate"
+    if _memory_cache.is_loading(flight_key):
+        return
+
+    def run():
+        with request_priority(PRIORITY_BACKGROUND):
+            _, error = _memory_cache.load(
+                flight_key, lambda: _fetch_and_store(cache_key, fetch))
+        if error:
+            logger.warning("Aggiornamento di %s fallito: %s", cache_key, error)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _cached(kind, cache_key, fetch):
+    """Memory, then disk, then network; stale disk entries are served and revalidated.
+
+    ``fetch`` is a callable returning (value, error), as the public functions do.
+    Concurrent misses on the same key share a single fetch.
+    """
+    ttl = CACHE_TTL[kind]
+    with timer(f"zoho.cache.memory.{kind}"):
+        value = _memory_cache.get(cache_key, ttl)
+    if value is not SingleFlightCache.MISSING:
+        increment(f"zoho.cache.{kind}.memory_hit")
+        return value, None
+
+    def load():
+        with timer(f"zoho.cache.disk.{kind}"):
+            entry = _get_disk_cache().get(cache_key)
+        if entry is None:
+            increment(f"zoho.cache.{kind}.miss")
+            return _fetch_and_store(cache_key, fetch)
+        value, fetched_at = entry
+        if time.time() - fetched_at > ttl:
+            increment(f"zoho.cache.{kind}.stale")
+            _revalidate(cache_key, fetch)
+        else:
+            increment(f"zoho.cache.{kind}.disk_hit")
+            _memory_cache.put(cache_key, value, fetched_at)
+        return value, None
+
+    return _memory_cache.load(cache_key, load)
+
+
+def _iter_cached(kind, cache_key, fetch, pages, on_complete=None, cached_items=None,
+                 page_items=None):
+    """Streaming counterpart of _cached: yields (items, None) chunks or a final (None, error).
+
+    A cached list (stale disk entries are revalidated as in _cached) is
+    yielded in one chunk. On a miss the pages from ``pages()`` are downloaded
+    by a producer thread, registered as the in-flight load of the key, and
+    yielded as they arrive; the complete list is cached at the end. The
+    producer never waits for the consumer, so concurrent _cached/_iter_cached
+    callers waiting on the key (possibly holding the only free executor
+    slots) always get its result, even if this stream is abandoned. If
+    another thread is already fetching the key, its result is awaited.
+    ``on_complete(items)`` receives the complete list. ``cached_items(items)``
+    and ``page_items(items)`` turn a cached list and a downloaded page into
+    the chunk to yield (default: as they are); empty chunks are skipped.
+    """
+    ttl = CACHE_TTL[kind]
+    value = _memory_cache.get(cache_key, ttl)
+    if value is SingleFlightCache.MISSING:
+        entry = _get_disk_cache().get(cache_key)
+        if entry is not None:
+            value, fetched_at = entry
+            if time.time() - fetched_at > ttl:
+                increment(f"zoho.cache.{kind}.stale")
+                _revalidate(cache_key, fetch)
+            else:
+                increment(f"zoho.cache.{kind}.disk_hit")
+                _memory_cache.put(cache_key, value, fetched_at)
+    else:
+        increment(f"zoho.cache.{kind}.memory_hit")
+
+    if value is SingleFlightCache.MISSING and not _memory_cache.begin(cache_key):
+        # Un altro thread sta già scaricando la chiave: ne aspetta il risultato
+        value, error = _cached(kind, cache_key, fetch)
+        if error:
+            yield None, error
+            return
+    if value is SingleFlightCache.MISSING:
+        increment(f"zoho.cache.{kind}.miss")
+        chunks = queue.Queue()
+        _stream_pages(cache_key, pages, chunks, on_complete)
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            items, error = chunk
+            if error:
+                yield None, error
+                return
+            if page_items is not None:
+                items = page_items(items)
+            if items:
+                yield items, None
+    if on_complete is not None:
+        on_complete(value)
+    if cached_items is not None:
+        value = cached_items(value)
+    if value:
+        yield value, None
+
+
+def _stream_pages(cache_key, pages, chunks, on_complete):
+    """Downloads a listing on its own thread for _iter_cached, which must have begun the flight.
+
+    Every (items, error) chunk goes to ``chunks``, followed by None; at the
+    end the flight of cache_key is completed with the whole list or the error.
+    """
+    priority = _current_priority()
+
+    def run():
+        value, result = [], None
+        try:
+            with request_priority(priority):
+                for items, error in pages():
+                    if error:
+                        result = (None, error)
+                        chunks.put((None, error))
+                        return
+                    value.extend(items)
+                    chunks.put((items, None))
+            _store(cache_key, value)
+            result = (value, None)
+            if on_complete is not None:
+                on_complete(value)
+        except Exception as e:
+            result = (None, str(e))
+            chunks.put(result)
+        finally:
+            _memory_cache.end(cache_key, result)
+            chunks.put(None)
+
+    threading.Thread(target=run, name="zoho-stream", daemon=True).start()
+
+
+def cache_stats():
+    """Returns hit/miss/coalesced/eviction counters of the in-memory cache."""
+    return _memory_cache.stats()
+
+
+def invalidate_cache(portal_id=None):
+    """Drops cached projects, tasks and users (of one portal, or all)."""
+    disk_cache = _get_disk_cache()
+    with _indexes_lock:
+        if portal_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(portal_id, None)
+    for kind in CACHE_TTL:
+        if portal_id is None:
+            key, prefix = None, f"{kind}:"
+        else:
+            key, prefix = f"{kind}:{portal_id}", f"{kind}:{portal_id}:"
+        _memory_cache.invalidate(key=key, prefix=prefix)
+        if key is not None:
+            disk_cache.delete(key)
+        disk_cache.delete_prefix(prefix)
+    # Senza dati in cache la prossima sync deve essere completa
+    if portal_id is None:
+        disk_cache.delete_prefix("sync:")
+    else:
+        disk_cache.delete(f"sync:{portal_id}")
+
+
+def refresh_from_zoho(portal_id):
+    """Discards the cache of a portal and downloads projects, tasks and users again.
+
+    Returns None on success, otherwise the error message.
+    """
+    invalidate_cache(portal_id)
+    projects, error = get_projects(portal_id)
+    if error:
+        return error
+    _, error = get_all_users(portal_id)
+    if error:
+        return error
+    get_all_tasks_parallel(portal_id, projects)
+    return None
+
+# --- INDICI ---
+
+
+class PortalIndex:
+    """Lookup tables over the cached tasks and users of one portal.
+
+    Holds what the lookups of this module need: users by email and tasks by
+    owner email. Each set_* call rebuilds only what it receives and does
+    nothing when given the same list object as the previous call: cache hits
+    return the same list, so the tables are rebuilt once per sync instead of
+    on every lookup. Lookups by email keep the first user with that email.
+    """
+
+    def __init__(self):
+        self.users_by_email = {}
+        # email owner -> {project_id: [task]}
+        self.tasks_by_owner = {}
+        self._sources = {}
+        self._project_owners = {}
+        self._lock = threading.Lock()
+
+    def _changed(self, key, items):
+        if self._sources.get(key) is items:
+            return False
+        self._sources[key] = items
+        return True
+
+    def set_users(self, users):
+        with self._lock:
+            if not self._changed("users", users):
+                return
+            by_email = {}
+            for user in users:
+                by_email.setdefault(user.get("email"), user)
+            self.users_by_email = by_email
+
+    def set_tasks(self, project_id, tasks):
+        project_id = str(project_id)
+        with self._lock:
+            if not self._changed(("tasks", project_id), tasks):
+                return
+            # Rimuove i task precedenti del progetto
+            for email in self._project_owners.pop(project_id, ()):
+                self.tasks_by_owner.get(email, {}).pop(project_id, None)
+
+            owners_of_project = set()
+            for task in tasks:
+                owners = task.get("owners_and_work", {}).get("owners", [])
+                for email in {owner.get("email") for owner in owners}:
+                    self.tasks_by_owner.setdefault(email, {}).setdefault(
+                        project_id, []).append(task)
+                    owners_of_project.add(email)
+            self._project_owners[project_id] = owners_of_project
+
+    def owner_tasks(self, email, project_id):
+        """Tasks of one project owned by email."""
+        with self._lock:
+            return list(self.tasks_by_owner.get(email, {}).get(str(project_id), []))
 
-# --- LOGGING ---
 
+_indexes = {}
+_indexes_lock = threading.Lock()
 
-def log_debug(msg):
-    # Attiva/disattiva debug facilmente
-    print(f"[DEBUG] {msg}")
+
+def get_portal_index(portal_id):
+    """Returns the PortalIndex of a portal, filled by get_tasks and get_all_users."""
+    with _indexes_lock:
+        index = _indexes.get(portal_id)
+        if index is None:
+            index = _indexes[portal_id] = PortalIndex()
+        return index
+
+# --- SESSIONE HTTP ---
+
+
+class _JitteredRetry(Retry):
+    """Retry with up to +50% random jitter on the exponential backoff."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return backoff + random.uniform(0, backoff / 2) if backoff else 0
+
+
+def _build_session():
+    """Creates the keep-alive session shared by every Zoho call.
+
+    Connection errors are retried for any method (the request never reached
+    the server); 5xx responses only for GET, since a POST may have been applied.
+    """
+    retry = _JitteredRetry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False,
+        # I 429 li gestisce _http_request tramite lo scheduler
+        respect_retry_after_header=False,
+    )
+    # Connessioni contemporanee: le prime pagine sui thread dei chiamanti,
+    # le successive sull'executor delle pagine
+    pool_size = MAX_WORKERS + PAGE_CONCURRENCY
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = _build_session()
+
+
+def configure_http(max_workers=None, timeout=None, retries=None, backoff=None):
+    """Changes pool size, timeouts or retry policy and rebuilds the shared session."""
+    global MAX_WORKERS, REQUEST_TIMEOUT, RETRY_TOTAL, RETRY_BACKOFF, _session
+    if max_workers is not None:
+        MAX_WORKERS = max_workers
+    if timeout is not None:
+        REQUEST_TIMEOUT = timeout
+    if retries is not None:
+        RETRY_TOTAL = retries
+    if backoff is not None:
+        RETRY_BACKOFF = backoff
+    old_session, _session = _session, _build_session()
+    old_session.close()
+
+
+_scheduler = RequestScheduler(API_QUOTAS, DEFAULT_QUOTA, GLOBAL_QUOTA, GLOBAL_EXEMPT)
+_priority = threading.local()
+
+
+@contextmanager
+def request_priority(priority):
+    """Sends the Zoho calls made by this thread inside the block with the given priority.
+
+    Use PRIORITY_INTERACTIVE for calls the user is waiting for and
+    PRIORITY_BACKGROUND for prefetches and syncs; the default is PRIORITY_NORMAL.
+    """
+    previous = getattr(_priority, "value", None)
+    _priority.value = priority
+    try:
+        yield
+    finally:
+        _priority.value = previous
+
+
+def _current_priority():
+    priority = getattr(_priority, "value", None)
+    return PRIORITY_NORMAL if priority is None else priority
+
+
+def _with_priority(priority, func, *args):
+    # I thread dei pool non ereditano la priorità di chi li ha lanciati
+    with request_priority(priority):
+        return func(*args)
+
+
+def _endpoint_of(url):
+    """Quota bucket of a URL: token, log, tasks, users, projects or default."""
+    path = urlparse(url).path.rstrip("/")
+    if path.endswith("/oauth/v2/token"):
+        return "token"
+    for name in ("log", "tasks", "users", "projects"):
+        if path.endswith(f"/{name}"):
+            return name
+    return "default"
+
+
+def _retry_after(response):
+    """Seconds requested by a Retry-After header (delay or HTTP date), or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_request(method, url, priority=None, **kwargs):
+    """Sends a request through the rate-limit scheduler, waiting out 429 responses."""
+    endpoint = _endpoint_of(url)
+    if priority is None:
+        priority = _current_priority()
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        waited = _scheduler.acquire(endpoint, priority)
+        metrics.observe(f"zoho.ratelimit_wait.{endpoint}", waited * 1000)
+        with timer(f"zoho.http.{endpoint}"):
+            response = _session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        increment(f"zoho.http.status.{response.status_code}")
+        if response.status_code != 429:
+            _scheduler.succeeded(endpoint)
+            return response
+        delay = _scheduler.throttled(endpoint, _retry_after(response))
+        logger.info("429 su %s: pausa di %.1fs (tentativo %d)", endpoint, delay, attempt + 1)
+    return response
+
+
+def configure_rate_limits(quotas=None, global_quota=None):
+    """Changes the quota of some endpoints ({endpoint: (requests, period_seconds)})
+    and/or the global quota they share ((requests, period_seconds)).
+    """
+    global GLOBAL_QUOTA
+    for name, (rate, period) in (quotas or {}).items():
+        API_QUOTAS[name] = (rate, period)
+        _scheduler.set_quota(name, rate, period)
+    if global_quota is not None:
+        GLOBAL_QUOTA = global_quota
+        _scheduler.set_global_quota(*global_quota)
+
+
+def scheduler_stats():
+    """Queue depth per priority lane, request and 429 counts and wait times, per endpoint,
+    plus the tokens left in the global quota under "global"."""
+    return _scheduler.stats()
 
 # --- TOKEN MANAGEMENT ---
 
+# Secondi prima della scadenza in cui il token viene rinnovato in background
+TOKEN_REFRESH_AHEAD = 300
+# Dopo un rinnovo fallito, per questi secondi non si riprova
+TOKEN_RETRY_DELAY = 10
 
-def get_access_token():
-    """Restituisce il token valido, rinfrescandolo se necessario."""
-    now = time.time()
-    if _cache["access_token"] and _cache["token_expiry"] > now:
-        return _cache["access_token"]
-    token = refresh_access_token()
-    return token
 
+class TokenManager:
+    """Holds the access token and refreshes it at most once per expiry.
 
-def refresh_access_token():
-    log_debug("Tentativo di refresh del token...")
-    creds = settings_manager.get_credentials()
-    if not all([creds.get("refresh_token"), creds.get("client_id"), creds.get("client_secret")]):
-        log_debug("Credenziali incomplete.")
+    Refreshes are serialized by a lock: callers finding an expired token wait
+    for the refresh in progress and reuse its result. A token close to expiry
+    (``refresh_ahead`` seconds) is still returned while a single background
+    refresh replaces it. On first use, a token saved in the keyring is reused
+    if it has not expired yet.
+    """
+
+    def __init__(self, refresh_ahead=TOKEN_REFRESH_AHEAD):
+        self.refresh_ahead = refresh_ahead
+        self._token = None
+        self._expiry = 0
+        self._restored = False
+        self._retry_at = 0
+        self._refreshed_at = 0
+        self._refreshing_ahead = False
+        self._lock = threading.Lock()
+
+    def _valid_token(self):
+        if self._token and self._expiry > time.time():
+            return self._token
         return None
 
-    token_url = "https://accounts.zoho.com/oauth/v2/token"
-    params = {
-        "refresh_token": creds["refresh_token"],
-        "client_id": creds["client_id"],
-        "client_secret": creds["client_secret"],
-        "grant_type": "refresh_token",
-    }
+    def _restore(self):
+        self._restored = True
+        token = settings_manager.get_access_token()
+        expiry = settings_manager.get_access_token_expiry()
+        if token and expiry and expiry > time.time():
+            self._token, self._expiry = token, expiry
+            logger.debug("Access token ancora valido ripristinato dal keyring.")
 
-    try:
-        response = requests.post(token_url, params=params)
-        response.raise_for_status()
-        token_data = response.json()
+    def get(self):
+        token = self._valid_token()
+        if token:
+            if self._expiry - time.time() < self.refresh_ahead:
+                self._refresh_ahead()
+            return token
+        with self._lock:
+            if not self._restored:
+                self._restore()
+            return self._valid_token() or self._refresh_locked()
+
+    def refresh(self, stale_token=None):
+        """Forces a refresh, unless another caller already replaced stale_token.
+
+        A token obtained in the last TOKEN_RETRY_DELAY seconds is also reused,
+        so a burst of 401 responses leads to a single refresh.
+        """
+        with self._lock:
+            token = self._valid_token()
+            if token and stale_token is not None and (
+                    token != stale_token or time.time() - self._refreshed_at < TOKEN_RETRY_DELAY):
+                return token
+            return self._refresh_locked()
+
+    def reset(self):
+        """Forgets the current token, e.g. after the credentials changed."""
+        with self._lock:
+            self._token, self._expiry = None, 0
+            self._restored = True
+            self._retry_at = self._refreshed_at = 0
+
+    def _refresh_ahead(self):
+        if self._refreshing_ahead:
+            return
+        self._refreshing_ahead = True
+
+        def run():
+            try:
+                with self._lock:
+                    # Un altro thread potrebbe averlo già rinnovato
+                    if self._expiry - time.time() < self.refresh_ahead:
+                        self._refresh_locked()
+            finally:
+                self._refreshing_ahead = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _refresh_locked(self):
+        if time.time() < self._retry_at:
+            return None
+        logger.debug("Tentativo di refresh del token...")
+        creds = settings_manager.get_credentials()
+        if not all([creds.get("refresh_token"), creds.get("client_id"), creds.get("client_secret")]):
+            logger.warning("Credenziali incomplete: impossibile rinnovare il token.")
+            return None
+
+        params = {
+            "refresh_token": creds["refresh_token"],
+            "client_id": creds["client_id"],
+            "client_secret": creds["client_secret"],
+            "grant_type": "refresh_token",
+        }
+
+        try:
+            response = _http_request("POST", TOKEN_URL, params=params)
+            response.raise_for_status()
+            token_data = response.json()
+        except requests.exceptions.RequestException as e:
+            logger.warning("Errore refresh token: %s", e)
+            self._retry_at = time.time() + TOKEN_RETRY_DELAY
+            return None
         access_token = token_data.get("access_token")
-        if access_token:
-            _cache["access_token"] = access_token
-            _cache["token_expiry"] = time.time(
-            ) + token_data.get("expires_in", 3600) - 60
-            settings_manager.save_access_token(access_token)
-            log_debug(f"Nuovo access token salvato: {access_token}")
-            return access_token
-    except requests.exceptions.RequestException as e:
-        log_debug(f"Errore refresh token: {e}")
-        return None
+        if not access_token:
+            self._retry_at = time.time() + TOKEN_RETRY_DELAY
+            return None
+        self._token = access_token
+        self._refreshed_at = time.time()
+        self._expiry = time.time() + token_data.get("expires_in", 3600) - 60
+        settings_manager.save_access_token(access_token, self._expiry)
+        logger.debug("Nuovo access token salvato (scade alle %s).", time.ctime(self._expiry))
+        return access_token
+
+
+_tokens = TokenManager()
+
+
+def get_access_token():
+    """Restituisce il token valido, rinfrescandolo se necessario."""
+    return _tokens.get()
+
+
+def refresh_access_token(stale_token=None):
+    """Rinnova il token; se stale_token è già stato sostituito restituisce quello nuovo."""
+    return _tokens.refresh(stale_token)
+
+
+def _on_settings_changed(kind, old, new):
+    # Credenziali modificate: token e dati in cache potrebbero non valere più
+    if kind != "credentials":
+        return
+    if any(old.get(k) != new.get(k) for k in ("client_id", "client_secret", "refresh_token", "api_domain")):
+        _tokens.reset()
+    if any(old.get(k) != new.get(k) for k in ("api_domain", "portal_id", "email")):
+        invalidate_cache()
+
+
+settings_manager.subscribe(_on_settings_changed)
 
 # --- API CALL ---
 
 
-def _make_api_call(method, api_url, json_payload=None):
+def _make_api_call(method, api_url, json_payload=None, extra_headers=None, priority=None,
+                   with_status=False):
+    """Returns (data, error), or (data, error, status) with with_status.
+
+    status is the HTTP status of the last response, None if none arrived.
+    """
+    with timer("zoho.api_call"):
+        data, error, status = _send_api_call(method, api_url, json_payload, extra_headers, priority)
+    if error:
+        increment("zoho.api_call.errors")
+        logger.debug("%s %s fallita: %s", method, api_url, error)
+    if with_status:
+        return data, error, status
+    return data, error
+
+
+def _send_api_call(method, api_url, json_payload, extra_headers, priority):
     token = get_access_token()
     if not token:
-        return None, "Impossibile ottenere un access token valido."
+        return None, "Impossibile ottenere un access token valido.", None
 
-    headers = {"Authorization": f"Zoho-oauthtoken {token}"}
+    method = method.upper()
+    if method not in ('GET', 'POST'):
+        return None, f"Metodo {method} non supportato", None
+
+    headers = {"Authorization": f"Zoho-oauthtoken {token}", **(extra_headers or {})}
     try:
-        if method.upper() == 'GET':
-            response = requests.get(api_url, headers=headers)
-        elif method.upper() == 'POST':
-            response = requests.post(
-                api_url, headers=headers, json=json_payload)
-        else:
-            return None, f"Metodo {method} non supportato"
+        response = _http_request(method, api_url, priority=priority,
+                                 headers=headers, json=json_payload)
 
         if response.status_code == 401:
             # Token scaduto, refresh
-            token = refresh_access_token()
+            token = refresh_access_token(stale_token=token)
             if not token:
-                return None, "Rinnovo token fallito"
-            headers = {"Authorization": f"Zoho-oauthtoken {token}"}
-            if method.upper() == 'GET':
-                response = requests.get(api_url, headers=headers)
-            else:
-                response = requests.post(
-                    api_url, headers=headers, json=json_payload)
+                return None, "Rinnovo token fallito", None
+            headers = {"Authorization": f"Zoho-oauthtoken {token}", **(extra_headers or {})}
+            response = _http_request(
+                method, api_url, priority=priority, headers=headers, json=json_payload)
 
         response.raise_for_status()
-        return response.json(), None
+        return response.json(), None, response.status_code
 
     except requests.exceptions.RequestException as e:
-        return None, str(e)
+        response = getattr(e, "response", None)
+        return None, str(e), response.status_code if response is not None else None
 
-# --- PROGETTI ---
 
+def _is_rejection(status):
+    """True for a 4xx answer other than 401/429: Zoho refused the request itself."""
+    return status is not None and 400 <= status < 500 and status not in (401, 429)
 
-def get_projects(portal_id: str):
-    if portal_id in _cache["projects"]:
-        return _cache["projects"][portal_id], None
+# --- PAGINAZIONE ---
+
+# Elementi per pagina
+PAGE_SIZE = 100
+# Condiviso: elenchi annidati (es. i task di più progetti) non moltiplicano le richieste in volo
+_page_executor = ThreadPoolExecutor(max_workers=PAGE_CONCURRENCY, thread_name_prefix="zoho-page")
 
-    creds = settings_manager.get_credentials()
-    api_domain = creds.get("api_domain")
-    if not api_domain:
-        return None, "Dominio API non impostato."
 
-    all_projects = []
-    page = 1
-    per_page = 100
+def _iter_pages(page_url, extract, per_page=PAGE_SIZE, concurrency=None):
+    """Yields (items, None) page by page, in order, or a final (None, error).
 
-    while True:
-        api_url = f"{api_domain}/api/v3/portal/{portal_id}/projects?page={page}&per_page={per_page}"
-        data, error = _make_api_call("GET", api_url)
+    The first page is fetched alone; if it is full, the following pages are
+    requested speculatively, ``concurrency`` at a time (sliding window), on
+    the page executor shared by every listing, so at most PAGE_CONCURRENCY
+    extra pages are in flight overall. The first short or empty page ends
+    the listing and outstanding requests beyond it are cancelled.
+
+    ``page_url(page, per_page)`` builds the URL, ``extract(data)`` returns the
+    list of items in a response.
+    """
+    data, error = _make_api_call("GET", page_url(1, per_page))
+    if error:
+        yield None, error
+        return
+    items = extract(data)
+    if items:
+        yield items, None
+    if len(items) < per_page:
+        return
+
+    concurrency = concurrency or PAGE_CONCURRENCY
+    priority = _current_priority()
+    pending = {}
+    try:
+        next_page = 2
+        for _ in range(concurrency):
+            pending[next_page] = _page_executor.submit(
+                _with_priority, priority, _make_api_call, "GET", page_url(next_page, per_page))
+            next_page += 1
+        page = 2
+        while True:
+            data, error = pending.pop(page).result()
+            if error:
+                yield None, error
+                return
+            items = extract(data)
+            if items:
+                yield items, None
+            if len(items) < per_page:
+                return
+            pending[next_page] = _page_executor.submit(
+                _with_priority, priority, _make_api_call, "GET", page_url(next_page, per_page))
+            next_page += 1
+            page += 1
+    finally:
+        for future in pending.values():
+            future.cancel()
+
+
+def _collect(pages):
+    """Collects every page of a listing: returns (items, error)."""
+    all_items = []
+    for items, error in pages:
         if error:
             return None, error
-        if not data:
-            break
+        all_items.extend(items)
+    return all_items, None
+
+
+def _portal_pages(portal_id, path, extract, since=None):
+    """_iter_pages over a portal listing (``path`` below the portal URL)."""
+    api_domain = settings_manager.get_credentials().get("api_domain")
+    if not api_domain:
+        yield None, "Dominio API non impostato."
+        return
+    yield from _iter_pages(
+        lambda page, per_page: _modified_since(
+            f"{api_domain}/api/v3/portal/{portal_id}/{path}?page={page}&per_page={per_page}", since),
+        extract)
+
+# --- PROGETTI ---
+
+
+def get_projects(portal_id: str):
+    return _cached("projects", f"projects:{portal_id}", lambda: _fetch_projects(portal_id))
 
-        all_projects.extend(data)
-        if len(data) < per_page:
-            break
-        page += 1
 
-    valid_statuses = ["In corso", "In sospeso", "In entrata", "Fase Finale"]
-    filtered_projects = [p for p in all_projects if p.get(
-        "status", {}).get("name") in valid_statuses]
+def iter_projects(portal_id):
+    """Yields the active projects page by page as (projects, None), or a final (None, error).
+
+    Same data and cache as get_projects, but on a cache miss every page is
+    yielded as soon as it arrives.
+    """
+    yield from _iter_cached(
+        "projects", f"projects:{portal_id}", lambda: _fetch_projects(portal_id),
+        lambda: _active_project_pages(portal_id))
+
+
+# Stati dei progetti su cui si può loggare tempo
+VALID_PROJECT_STATUSES = ("In corso", "In sospeso", "In entrata", "Fase Finale")
+
+
+def _is_active_project(project):
+    return project.get("status", {}).get("name") in VALID_PROJECT_STATUSES
+
+
+def _fetch_projects(portal_id):
+    return _collect(_active_project_pages(portal_id))
+
+
+def _project_pages(portal_id, since=None):
+    """Pages of every project of the portal, or only those modified after ``since`` (epoch)."""
+    return _portal_pages(portal_id, "projects", lambda data: data or [], since)
+
+
+def _active_project_pages(portal_id):
+    for projects, error in _project_pages(portal_id):
+        if error:
+            yield None, error
+            return
+        active = [p for p in projects if _is_active_project(p)]
+        if active:
+            yield active, None
+
 
-    _cache["projects"][portal_id] = filtered_projects
-    return filtered_projects, None
+def _fetch_all_projects(portal_id, since=None):
+    """Every project of the portal, or only those modified after ``since`` (epoch)."""
+    return _collect(_project_pages(portal_id, since))
 
 # --- TASKS ---
 
 
 def get_tasks(portal_id, project_id):
-    
+    """Returns the tasks of a project owned by the configured user."""
+    tasks, error = _cached("tasks", f"tasks:{portal_id}:{project_id}",
+                           lambda: _fetch_tasks(portal_id, project_id))
+    if error:
+        return None, error
+    index = get_portal_index(portal_id)
+    index.set_tasks(project_id, tasks)
     user_email = settings_manager.get_credentials().get("email")
-    if (portal_id, project_id) in _cache["tasks"]:
-        return _cache["tasks"][(portal_id, project_id)], None
+    return index.owner_tasks(user_email, project_id), None
 
-    creds = settings_manager.get_credentials()
-    api_domain = creds.get("api_domain")
-    if not api_domain:
-        return None, "Dominio API non impostato."
 
-    api_url = f"{api_domain}/api/v3/portal/{portal_id}/projects/{project_id}/tasks"
-    data, error = _make_api_call('GET', api_url)
-    if error:
-        return None, error
+def _is_owned_by(task, email):
+    return any(owner.get("email") == email
+               for owner in task.get("owners_and_work", {}).get("owners", []))
+
+
+def iter_tasks(portal_id, project_id):
+    """Yields the tasks of a project owned by the configured user page by page.
+
+    Chunks are (tasks, None), or a final (None, error); see iter_projects.
+    """
+    user_email = settings_manager.get_credentials().get("email")
+    index = get_portal_index(portal_id)
+    yield from _iter_cached(
+        "tasks", f"tasks:{portal_id}:{project_id}",
+        lambda: _fetch_tasks(portal_id, project_id),
+        lambda: _task_pages(portal_id, project_id),
+        on_complete=lambda tasks: index.set_tasks(project_id, tasks),
+        # Dalla cache risponde l'indice; solo le pagine appena scaricate vanno filtrate
+        cached_items=lambda tasks: index.owner_tasks(user_email, project_id),
+        page_items=lambda tasks: [task for task in tasks if _is_owned_by(task, user_email)])
+
+
+def _task_pages(portal_id, project_id, since=None):
+    # In cache vanno tutti i task: il filtro per owner lo fa PortalIndex
+    return _portal_pages(portal_id, f"projects/{project_id}/tasks",
+                         lambda data: (data or {}).get("tasks", []), since)
+
 
-    tasks = data.get('tasks', []) if data else []
-    print(f"Recuperati {len(tasks)} tasks per il progetto {project_id}")
-    filtered_tasks = []
-    for task in tasks:
-        owners_and_work = task.get("owners_and_work", {})
-        owners = owners_and_work.get("owners", [])
-        # Controlla se zpuid è tra gli owners
-        if any(owner.get("email") == user_email for owner in owners):
-            filtered_tasks.append(task)
-    print(filtered_tasks)
-    _cache["tasks"][(portal_id, project_id)] = filtered_tasks
-    return filtered_tasks, None
+def _fetch_tasks(portal_id, project_id, since=None):
+    tasks, error = _collect(_task_pages(portal_id, project_id, since))
+    if not error:
+        logger.debug("Recuperati %d task per il progetto %s", len(tasks), project_id)
+    return tasks, error
 
 # --- GET ALL TASKS PARALLEL ---
 
 
 def get_all_tasks_parallel(portal_id, projects):
     results = {}
-    with ThreadPoolExecutor(max_workers=5) as executor:
+    priority = _current_priority()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         future_map = {executor.submit(
-            get_tasks, portal_id, p['id']): p['id'] for p in projects}
+            _with_priority, priority, get_tasks, portal_id, p['id']): p['id'] for p in projects}
         for future in future_map:
             project_id = future_map[future]
             tasks, error = future.result()
@@ -184,54 +890,188 @@ def get_all_tasks_parallel(portal_id, projects):
 
 
 def get_all_users(portal_id: str):
-    if _cache["users"] is not None:
-        return _cache["users"], None
+    users, error = _cached("users", f"users:{portal_id}", lambda: _fetch_users(portal_id))
+    if not error:
+        get_portal_index(portal_id).set_users(users)
+    return users, error
 
-    creds = settings_manager.get_credentials()
-    api_domain = creds.get("api_domain")
-    if not api_domain:
-        return None, "Dominio API non impostato."
 
-    all_users = []
-    page = 1
-    per_page = 100
+def iter_users(portal_id):
+    """Yields the portal users page by page as (users, None), or a final (None, error)."""
+    yield from _iter_cached(
+        "users", f"users:{portal_id}", lambda: _fetch_users(portal_id),
+        lambda: _user_pages(portal_id),
+        on_complete=get_portal_index(portal_id).set_users)
 
-    while True:
-        api_url = f"{api_domain}/api/v3/portal/{portal_id}/users?page={page}&per_page={per_page}"
-        data, error = _make_api_call("GET", api_url)
-        if error:
-            return None, error
 
-        users_batch = data.get("users", [])
-        if not users_batch:
-            break
+def _user_pages(portal_id):
+    return _portal_pages(portal_id, "users", lambda data: (data or {}).get("users", []))
 
-        all_users.extend(users_batch)
-        if len(users_batch) < per_page:
-            break
-        page += 1
 
-    _cache["users"] = all_users
-    return all_users, None
+def _fetch_users(portal_id):
+    return _collect(_user_pages(portal_id))
 
 
 def get_user_by_email(portal_id, email):
     users, error = get_all_users(portal_id)
     if error:
         return None, error
-    for user in users:
-        if user.get('email') == email:
-            return user, None
+    user = get_portal_index(portal_id).users_by_email.get(email)
+    if user:
+        return user, None
     return None, "Email utente non trovata nel portale Zoho."
 
+# --- SYNC INCREMENTALE ---
+
+# Filtro della API per i record modificati dopo un istante (epoch in millisecondi)
+MODIFIED_SINCE_PARAM = "last_modified_time"
+# Campo del progetto che Zoho aggiorna anche quando cambiano i suoi task
+PROJECT_MODIFIED_FIELD = "last_modified_time"
+# Margine sull'high-water mark, contro orologi non allineati con Zoho
+SYNC_OVERLAP = 5 * 60
+# Dopo questo intervallo la sync è completa: rimuove anche i record cancellati
+FULL_SYNC_INTERVAL = 7 * 24 * 3600
+
+
+def _modified_since(url, since):
+    if since is None:
+        return url
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}{MODIFIED_SINCE_PARAM}={int(since * 1000)}"
+
+
+def _cached_value(cache_key):
+    """Current cached value regardless of TTL (memory first, then disk), or None."""
+    value = _memory_cache.peek(cache_key)
+    if value is not SingleFlightCache.MISSING:
+        return value
+    entry = _get_disk_cache().get(cache_key)
+    return entry[0] if entry else None
+
+
+def _merge_by_id(current, changes, keep=None):
+    """Applies changed records to a cached list, matching them by id.
+
+    Updated records replace the old ones in place, new ones are appended and
+    records for which ``keep`` returns False are removed.
+    """
+    changed = {str(item["id"]): item for item in changes}
+    merged = []
+    for item in current:
+        item = changed.pop(str(item["id"]), item)
+        if keep is None or keep(item):
+            merged.append(item)
+    merged.extend(item for item in changed.values() if keep is None or keep(item))
+    return merged
+
+
+def _sync_tasks(portal_id, project_id, since):
+    cache_key = f"tasks:{portal_id}:{project_id}"
+    current = _cached_value(cache_key)
+    if current is None:
+        # Progetto nuovo o mai scaricato: serve la lista completa
+        return _fetch_and_store(cache_key, lambda: _fetch_tasks(portal_id, project_id))[1]
+    changes, error = _fetch_tasks(portal_id, project_id, since)
+    if error:
+        return error
+    if changes:
+        _store(cache_key, _merge_by_id(current, changes))
+    else:
+        # Nessuna modifica: la voce resta valida per un altro TTL
+        fetched_at = time.time()
+        _memory_cache.touch(cache_key, fetched_at)
+        _get_disk_cache().touch(cache_key, fetched_at)
+    return None
+
+
+def sync_portal(portal_id, full=False):
+    """Brings the cached projects and tasks of a portal up to date.
+
+    Asks Zoho only for the projects modified since the last sync (the
+    per-portal high-water mark) and merges them into the cache; tasks are
+    requested only for projects whose PROJECT_MODIFIED_FIELD moved, so a
+    delta with no changes costs a single request. Projects whose status
+    leaves VALID_PROJECT_STATUSES are removed together with their tasks. Records deleted on Zoho do not show up in a delta, so every
+    FULL_SYNC_INTERVAL (or with full=True, or when nothing is cached yet) the
+    whole portal is downloaded again.
+
+    Returns None on success, otherwise the error message.
+    """
+    disk_cache = _get_disk_cache()
+    state_key = f"sync:{portal_id}"
+    entry = disk_cache.get(state_key)
+    state = entry[0] if entry else None
+    started = time.time()
+    current_projects = _cached_value(f"projects:{portal_id}")
+
+    if full or state is None or current_projects is None or \
+            started - state["last_full"] > FULL_SYNC_INTERVAL:
+        logger.info("Sync completa del portale %s", portal_id)
+        error = refresh_from_zoho(portal_id)
+        if error:
+            return error
+        disk_cache.set(state_key, {"since": started - SYNC_OVERLAP, "last_full": started})
+        return None
+
+    since = state["since"]
+    changes, error = _fetch_all_projects(portal_id, since)
+    if error:
+        return error
+    projects = _merge_by_id(current_projects, changes, _is_active_project)
+    if changes:
+        _store(f"projects:{portal_id}", projects)
+    else:
+        _memory_cache.touch(f"projects:{portal_id}", started)
+        disk_cache.touch(f"projects:{portal_id}", started)
+
+    # I task dei progetti usciti dalla lista non servono più
+    active_ids = {str(p["id"]) for p in projects}
+    for project in current_projects:
+        if str(project["id"]) not in active_ids:
+            _memory_cache.invalidate(key=f"tasks:{portal_id}:{project['id']}")
+            disk_cache.delete(f"tasks:{portal_id}:{project['id']}")
+
+    # Solo i progetti il cui last_modified_time è cambiato (o senza task in cache)
+    # richiedono i task; per gli altri la voce in cache resta valida
+    previous = {str(p["id"]): p.get(PROJECT_MODIFIED_FIELD) for p in current_projects}
+    moved = {str(p["id"]) for p in changes
+             if p.get(PROJECT_MODIFIED_FIELD) is None
+             or previous.get(str(p["id"])) != p.get(PROJECT_MODIFIED_FIELD)}
+    stale = []
+    for project in projects:
+        cache_key = f"tasks:{portal_id}:{project['id']}"
+        if str(project["id"]) in moved or _cached_value(cache_key) is None:
+            stale.append(project)
+        else:
+            _memory_cache.touch(cache_key, started)
+            disk_cache.touch(cache_key, started)
+
+    priority = _current_priority()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        errors = [e for e in executor.map(
+            lambda p: _with_priority(priority, _sync_tasks, portal_id, p["id"], since), stale) if e]
+    if errors:
+        return errors[0]
+    logger.debug("Sync incrementale del portale %s: %d progetti modificati, task riletti per %d",
+                 portal_id, len(changes), len(stale))
+    disk_cache.set(state_key, {"since": started - SYNC_OVERLAP, "last_full": state["last_full"]})
+    return None
+
 # --- LOG TIME ---
 
 
-def log_time_to_zoho(portal_id, project_id, task_id, event_name, notes, log_date, start_time, end_time, bill_status, owner_zpuid):
+def log_time_to_zoho(portal_id, project_id, task_id, event_name, notes, log_date, start_time, end_time, bill_status, owner_zpuid,
+                     idempotency_key=None):
+    """Posts a time log; idempotency_key, if given, is sent as the Idempotency-Key header.
+
+    Returns {"success", "message", "rejected"}: rejected is True when Zoho
+    refused the log itself (4xx other than 401/429), so sending it again as
+    it is will not help; it is False for network, token and server errors.
+    """
     creds = settings_manager.get_credentials()
     api_domain = creds.get("api_domain")
     if not api_domain:
-        return {"success": False, "message": "Dominio API non impostato."}
+        return {"success": False, "message": "Dominio API non impostato.", "rejected": False}
 
     api_url = f"{api_domain}/api/v3/portal/{portal_id}/projects/{project_id}/log"
     payload = {
@@ -245,7 +1085,54 @@ def log_time_to_zoho(portal_id, project_id, task_id, event_name, notes, log_date
         "module": {"id": task_id, "type": "task"}
     }
 
-    data, error = _make_api_call('POST', api_url, json_payload=payload)
+    extra_headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+    # L'utente aspetta questo invio: passa davanti ai download in background
+    data, error, status = _make_api_call('POST', api_url, json_payload=payload,
+                                         extra_headers=extra_headers, priority=PRIORITY_INTERACTIVE,
+                                         with_status=True)
     if error:
-        return {"success": False, "message": error}
-    return {"success": True, "message": "Tempo loggato con successo su Zoho."}
+        return {"success": False, "message": error, "rejected": _is_rejection(status)}
+    return {"success": True, "message": "Tempo loggato con successo su Zoho.", "rejected": False}
+
+# --- LOG TIME IN BATCH ---
+
+# Time log inviati contemporaneamente da log_times_to_zoho
+LOG_BATCH_CONCURRENCY = 4
+
+
+def log_times_to_zoho(portal_id, entries, max_workers=None):
+    """Submits several time logs concurrently, resolving the owner only once.
+
+    Each entry is a dict with the keyword arguments of log_time_to_zoho
+    (project_id, task_id, event_name, notes, log_date, start_time, end_time,
+    bill_status, idempotency_key); other keys (e.g. event_id) are ignored and
+    returned as-is. Returns one {"success", "message", "rejected", "entry"}
+    dict per entry, in order; an owner that cannot be resolved fails every
+    entry, not rejected.
+    """
+    email = settings_manager.get_credentials().get("email")
+    user, error = get_user_by_email(portal_id, email)
+    if error:
+        message = f"Impossibile recuperare l'utente: {error}"
+        return [{"success": False, "message": message, "rejected": False, "entry": entry}
+                for entry in entries]
+    owner_zpuid = user.get('id')
+
+    def submit(entry):
+        result = log_time_to_zoho(
+            portal_id=portal_id,
+            project_id=entry["project_id"],
+            task_id=entry["task_id"],
+            event_name=entry["event_name"],
+            notes=entry.get("notes", ""),
+            log_date=entry["log_date"],
+            start_time=entry["start_time"],
+            end_time=entry["end_time"],
+            bill_status=entry.get("bill_status", "Billable"),
+            owner_zpuid=owner_zpuid,
+            idempotency_key=entry.get("idempotency_key"),
+        )
+        return dict(result, entry=entry)
+
+    with ThreadPoolExecutor(max_workers=max_workers or LOG_BATCH_CONCURRENCY) as executor:
+        return list(executor.map(submit, entries))
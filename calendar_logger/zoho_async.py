@@ -0,0 +1,150 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from calendar_logger import zoho_api
+
+# --- CLIENT ASINCRONO ---
+
+
+def _with_priority(priority, func, *args, **kwargs):
+    # La priorità di zoho_api è per thread: va impostata sul thread dell'executor
+    if priority is None:
+        return func(*args, **kwargs)
+    with zoho_api.request_priority(priority):
+        return func(*args, **kwargs)
+
+
+class AsyncZohoClient:
+    """Coroutine counterparts of the zoho_api functions.
+
+    This is not an asyncio-native HTTP client: every call runs the
+    synchronous zoho_api function (token, cache, pagination and the pooled
+    keep-alive requests session) on a dedicated executor, so the blocking
+    I/O still happens on its threads. What it gives the app is one place
+    to await, gather and stream Zoho calls without a thread per click. A
+    semaphore caps the calls in flight at the size of the executor and of
+    the connection pool.
+    """
+
+    def __init__(self, max_concurrency=None):
+        self.max_concurrency = max_concurrency or zoho_api.MAX_WORKERS
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="zoho-async")
+
+    async def _call(self, func, *args, **kwargs):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _iterate(self, pages):
+        """Async generator over a zoho_api page iterator, advanced on the executor."""
+        loop = asyncio.get_running_loop()
+        done = object()
+        try:
+            while True:
+                async with self._semaphore:
+                    chunk = await loop.run_in_executor(self._executor, next, pages, done)
+                if chunk is done:
+                    return
+                yield chunk
+        finally:
+            pages.close()
+
+    async def get_projects(self, portal_id):
+        return await self._call(zoho_api.get_projects, portal_id)
+
+    def iter_projects(self, portal_id):
+        """Async counterpart of zoho_api.iter_projects: ``async for projects, error in ...``."""
+        return self._iterate(zoho_api.iter_projects(portal_id))
+
+    async def get_tasks(self, portal_id, project_id):
+        return await self._call(zoho_api.get_tasks, portal_id, project_id)
+
+    def iter_tasks(self, portal_id, project_id):
+        return self._iterate(zoho_api.iter_tasks(portal_id, project_id))
+
+    async def get_all_tasks(self, portal_id, projects):
+        """Fetches the tasks of every project concurrently: returns {project_id: tasks}."""
+        results = await asyncio.gather(
+            *(self.get_tasks(portal_id, p['id']) for p in projects))
+        return {p['id']: tasks for p, (tasks, _) in zip(projects, results)}
+
+    async def get_all_users(self, portal_id):
+        return await self._call(zoho_api.get_all_users, portal_id)
+
+    def iter_users(self, portal_id):
+        return self._iterate(zoho_api.iter_users(portal_id))
+
+    async def get_user_by_email(self, portal_id, email):
+        return await self._call(zoho_api.get_user_by_email, portal_id, email)
+
+    async def log_time_to_zoho(self, **kwargs):
+        return await self._call(zoho_api.log_time_to_zoho, **kwargs)
+
+    async def sync_portal(self, portal_id, full=False, priority=None):
+        """Async counterpart of zoho_api.sync_portal: returns None or the error message."""
+        return await self._call(_with_priority, priority, zoho_api.sync_portal, portal_id, full=full)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# --- EVENT LOOP IN BACKGROUND ---
+
+
+class BackgroundLoop:
+    """One asyncio event loop running in a daemon thread, started on first use."""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="zoho-loop", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """Schedules a coroutine from any thread; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_running())
+
+    def stop(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop.close()
+            self._loop = self._thread = None
+
+
+_background = BackgroundLoop()
+client = AsyncZohoClient()
+
+
+def submit(coro):
+    """Runs a coroutine on the shared background loop (e.g. one of client's methods)."""
+    return _background.submit(coro)
+
+
+def run_blocking(func, *args, **kwargs):
+    """Runs a blocking non-Zoho job (e.g. database maintenance) on the background loop's
+    default executor, keeping the Zoho executor free; returns a concurrent.futures.Future.
+    """
+    async def run():
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(func, *args, **kwargs))
+
+    return _background.submit(run())
+
+
+def shutdown():
+    _background.stop()
+    client.close()
@@ -0,0 +1,199 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class DiskCache:
+    """Persistent key/value store for Zoho responses, backed by SQLite.
+
+    Values are stored as JSON together with the time they were fetched, so
+    callers can decide themselves whether an entry is stale.
+    """
+
+    def __init__(self, path="zoho_cache.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, key):
+        """Returns (value, fetched_at), or None if the key is not stored."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, fetched_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, fetched_at=None):
+        payload = json.dumps(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, fetched_at) VALUES (?, ?, ?)",
+                (key, payload, fetched_at if fetched_at is not None else time.time()))
+            self._conn.commit()
+
+    def touch(self, key, fetched_at=None):
+        """Marks an entry as freshly fetched without rewriting its value."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET fetched_at = ? WHERE key = ?",
+                (fetched_at if fetched_at is not None else time.time(), key))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def delete_prefix(self, prefix=""):
+        """Removes every key starting with prefix (all keys if empty)."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_MISSING = object()
+
+
+class _Flight:
+    """A load in progress; other callers wait on it instead of fetching again."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlightCache:
+    """Thread-safe in-memory cache with TTL, LRU bound and request coalescing.
+
+    ``get`` drops entries older than the given TTL. ``load`` runs a loader at
+    most once per key at a time: concurrent callers for the same key wait for
+    the in-flight call and share its (value, error) result. ``begin``/``end``
+    register a load run outside ``load`` (such as a streamed listing), so
+    that callers of ``load`` wait for it too.
+    """
+
+    MISSING = _MISSING
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl):
+        """Returns the cached value, or SingleFlightCache.MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > ttl:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def peek(self, key):
+        """Returns the cached value regardless of age, without touching stats or LRU order."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return _MISSING if entry is None else entry[0]
+
+    def touch(self, key, fetched_at=None):
+        """Marks an entry, if present, as freshly fetched."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], fetched_at if fetched_at is not None else time.time())
+
+    def put(self, key, value, fetched_at=None):
+        with self._lock:
+            self._entries[key] = (value, fetched_at if fetched_at is not None else time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def is_loading(self, key):
+        with self._lock:
+            return key in self._flights
+
+    def begin(self, key):
+        """Registers a load of key run by the caller (e.g. a streamed download).
+
+        Returns False if a load of key is already in flight. Every begin that
+        returns True must be followed by end().
+        """
+        with self._lock:
+            if key in self._flights:
+                return False
+            self._flights[key] = _Flight()
+            return True
+
+    def end(self, key, result=None):
+        """Completes a load started with begin, handing (value, error) to the waiting callers.
+
+        With result None (load abandoned) the waiting callers run the load themselves.
+        """
+        with self._lock:
+            flight = self._flights.pop(key)
+        flight.result = result
+        flight.done.set()
+
+    def load(self, key, loader):
+        """Calls loader() -> (value, error) once for all concurrent callers of key."""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    self._flights[key] = _Flight()
+                    break
+                self.coalesced += 1
+            flight.done.wait()
+            if flight.result is not None:
+                return flight.result
+        result = None
+        try:
+            result = loader()
+        except Exception as e:
+            result = (None, str(e))
+        finally:
+            self.end(key, result)
+        return result
+
+    def invalidate(self, key=None, prefix=None):
+        """Drops one key, every key with a prefix, or everything if both are None."""
+        with self._lock:
+            if key is None and prefix is None:
+                self._entries.clear()
+                return
+            for cached_key in list(self._entries):
+                if cached_key == key or (prefix is not None and cached_key.startswith(prefix)):
+                    del self._entries[cached_key]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                    "evictions": self.evictions, "size": len(self._entries)}
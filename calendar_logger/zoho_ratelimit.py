@@ -0,0 +1,200 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Corsie di priorità: il numero più basso viene servito per primo
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class TokenBucket:
+    """Allows ``rate`` requests every ``period`` seconds, in bursts of up to ``rate``."""
+
+    def __init__(self, rate, period):
+        self.capacity = rate
+        self.refill_per_second = rate / period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.refill_per_second
+
+    def take(self):
+        self.tokens -= 1
+
+    def empty(self, now):
+        self._refill(now)
+        self.tokens = 0
+
+
+class _Endpoint:
+    def __init__(self, rate, period):
+        self.bucket = TokenBucket(rate, period)
+        # Heap di (priorità, numero d'arrivo) delle richieste in attesa
+        self.waiters = []
+        self.waiting = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.blocked_until = 0
+        self.backoff = 0
+        self.requests = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def delay(self, now):
+        """Seconds until the endpoint may send again (pause and bucket)."""
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        return self.bucket.delay(now)
+
+
+class RequestScheduler:
+    """Admits requests according to a global quota and per-endpoint quotas.
+
+    Every request takes a token from the global bucket (the per-user limit
+    shared by all endpoints, unless its endpoint is in ``global_exempt``) and
+    one from the bucket of its endpoint, which acts as an extra cap. Waiting
+    callers are served in priority order across all endpoints (interactive,
+    then normal, then background; first come first served within a lane):
+    the next global token goes to the most urgent request whose endpoint can
+    send, so an interactive call overtakes a backlog of background
+    prefetches even on another endpoint.
+
+    ``throttled`` records a 429: the endpoint is paused for the Retry-After
+    time or, if the server gave none, for a backoff that doubles on every
+    consecutive 429 and resets after the next success.
+    """
+
+    def __init__(self, quotas=None, default_quota=(100, 120), global_quota=None,
+                 global_exempt=(), min_backoff=1.0, max_backoff=60.0):
+        self.quotas = dict(quotas or {})
+        self.default_quota = default_quota
+        self.global_quota = global_quota
+        self.global_exempt = frozenset(global_exempt)
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._global = TokenBucket(*global_quota) if global_quota else None
+        self._endpoints = {}
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _endpoint(self, name):
+        endpoint = self._endpoints.get(name)
+        if endpoint is None:
+            rate, period = self.quotas.get(name, self.default_quota)
+            endpoint = self._endpoints[name] = _Endpoint(rate, period)
+        return endpoint
+
+    def set_quota(self, name, rate, period):
+        """Changes the quota of an endpoint; its bucket restarts full."""
+        with self._cond:
+            self.quotas[name] = (rate, period)
+            endpoint = self._endpoints.get(name)
+            if endpoint is not None:
+                endpoint.bucket = TokenBucket(rate, period)
+            self._cond.notify_all()
+
+    def set_global_quota(self, rate, period):
+        """Changes the quota shared by all endpoints; the bucket restarts full."""
+        with self._cond:
+            self.global_quota = (rate, period)
+            self._global = TokenBucket(rate, period)
+            self._cond.notify_all()
+
+    def _next_ready(self, now):
+        """Most urgent ticket, among the heads of the metered endpoint queues, that may send now."""
+        ready = [endpoint.waiters[0] for name, endpoint in self._endpoints.items()
+                 if endpoint.waiters and name not in self.global_exempt
+                 and endpoint.delay(now) == 0]
+        return min(ready, default=None)
+
+    def acquire(self, name, priority=PRIORITY_NORMAL):
+        """Blocks until a request to endpoint ``name`` may be sent; returns the seconds waited."""
+        start = time.monotonic()
+        with self._cond:
+            endpoint = self._endpoint(name)
+            metered = self._global is not None and name not in self.global_exempt
+            ticket = (priority, next(self._arrivals))
+            heapq.heappush(endpoint.waiters, ticket)
+            endpoint.waiting[priority] += 1
+            try:
+                while True:
+                    timeout = None
+                    # Solo la prima richiesta della coda dell'endpoint può prendere un token
+                    if endpoint.waiters[0] == ticket:
+                        now = time.monotonic()
+                        timeout = endpoint.delay(now)
+                        # Il token globale va alla richiesta più urgente che può partire
+                        if timeout == 0 and metered:
+                            timeout = None
+                            if self._next_ready(now) == ticket:
+                                timeout = self._global.delay(now)
+                                if timeout == 0:
+                                    self._global.take()
+                        if timeout == 0:
+                            endpoint.bucket.take()
+                            break
+                    self._cond.wait(timeout)
+            finally:
+                endpoint.waiters.remove(ticket)
+                heapq.heapify(endpoint.waiters)
+                endpoint.waiting[priority] -= 1
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            endpoint.requests += 1
+            endpoint.wait_total += waited
+            endpoint.wait_max = max(endpoint.wait_max, waited)
+        return waited
+
+    def throttled(self, name, retry_after=None):
+        """Records a 429 for an endpoint; returns the seconds it stays paused."""
+        with self._cond:
+            endpoint = self._endpoint(name)
+            endpoint.throttled += 1
+            endpoint.backoff = min(self.max_backoff,
+                                   endpoint.backoff * 2 if endpoint.backoff else self.min_backoff)
+            delay = retry_after if retry_after is not None else endpoint.backoff
+            now = time.monotonic()
+            endpoint.blocked_until = max(endpoint.blocked_until, now + delay)
+            # Il server ha detto basta: i token rimasti non valgono più
+            endpoint.bucket.empty(now)
+            self._cond.notify_all()
+            return delay
+
+    def succeeded(self, name):
+        with self._cond:
+            self._endpoint(name).backoff = 0
+
+    def stats(self):
+        """Per endpoint: queued requests by lane, requests, 429s and wait times in ms.
+
+        With a global quota, the "global" entry holds the quota and the tokens left.
+        """
+        with self._cond:
+            stats = {name: {
+                "queued": {PRIORITY_NAMES[p]: n for p, n in endpoint.waiting.items()},
+                "requests": endpoint.requests,
+                "throttled": endpoint.throttled,
+                "wait_avg_ms": round(endpoint.wait_total / endpoint.requests * 1000, 1)
+                if endpoint.requests else 0.0,
+                "wait_max_ms": round(endpoint.wait_max * 1000, 1),
+            } for name, endpoint in self._endpoints.items()}
+            if self._global is not None:
+                self._global.delay(time.monotonic())
+                stats["global"] = {"quota": self.global_quota,
+                                   "tokens": round(self._global.tokens, 1)}
+            return stats
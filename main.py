@@ -1,11 +1,35 @@
+import os
 from calendar_logger.app import App
 from calendar_logger.database import Database
+from calendar_logger.outbox import OutboxWorker
+from calendar_logger import instrumentation, zoho_async
 
 if __name__ == "__main__":
-    # Inizializza il database e crea la tabella se non esiste
-    db = Database()
-    db.create_table()
+    # Log su stderr: il debug si attiva con CALENDAR_LOGGER_DEBUG=1
+    instrumentation.configure_logging()
+
+    # Inizializza il database e migra lo schema all'ultima versione
+    db = Database(wal=True)
+    db.migrate()
+
+    # Invia in background i log Zoho in coda (anche quelli rimasti dall'ultima sessione)
+    outbox = OutboxWorker(db)
+    outbox.start()
 
     # Crea e avvia l'applicazione
-    app = App(db=db)
-    app.mainloop()
\ No newline at end of file
+    app = App(db=db, outbox=outbox)
+    app.mainloop()
+
+    # Ferma il loop asincrono delle chiamate Zoho e il worker dell'outbox
+    zoho_async.shutdown()
+    outbox.stop()
+
+    # Attende il completamento delle scritture in coda prima di uscire
+    db.close()
+
+    # Sessione di profiling: istogrammi delle latenze nel log e, se richiesto, su file
+    instrumentation.get_logger("calendar_logger").debug(
+        "Metriche della sessione:\n%s", instrumentation.metrics.report())
+    metrics_path = os.environ.get(instrumentation.METRICS_ENV)
+    if metrics_path:
+        instrumentation.metrics.export(metrics_path)
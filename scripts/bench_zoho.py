@@ -0,0 +1,185 @@
+# Benchmarks calendar_logger.zoho_api against the local stand-in server.
+# Run from the project root: python scripts/bench_zoho.py [--latency-ms 20] [--json out.json]
+# With --baseline old.json the run fails if a p95 got worse by more than --tolerance.
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_logger import instrumentation, settings_manager, zoho_api  # noqa: E402
+from calendar_logger.zoho_cache import DiskCache  # noqa: E402
+from fake_zoho_server import FakeZohoServer, USER_EMAIL, build_dataset  # noqa: E402
+
+PORTAL_ID = "1"
+
+
+def use_fake_server(fake):
+    """Points zoho_api at the local server instead of Zoho and the keyring."""
+    credentials = {
+        "client_id": "fake", "client_secret": "fake", "refresh_token": "fake",
+        "api_domain": fake.url, "portal_id": PORTAL_ID, "email": USER_EMAIL,
+    }
+    settings_manager.get_credentials = lambda: dict(credentials)
+    settings_manager.save_access_token = lambda token, expires_at=None: None
+    settings_manager.get_access_token = lambda: None
+    settings_manager.get_access_token_expiry = lambda: None
+    zoho_api.TOKEN_URL = f"{fake.url}/oauth/v2/token"
+
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[max(0, int(len(ordered) * fraction) - 1)]
+
+
+def measure(label, call, iterations, fake=None, setup=None):
+    """Times call() ``iterations`` times (setup() runs untimed before each call).
+
+    Returns a dict with p50/p95 in ms, calls per second and, if a fake
+    server is given, HTTP requests per second and the requests per call.
+    """
+    timings = []
+    requests_before = fake.request_count if fake else 0
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    total = sum(timings)
+    result = {
+        "p50_ms": round(statistics.median(timings) * 1000, 2),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 2),
+        "calls_per_s": round(iterations / total, 1),
+    }
+    if fake is not None:
+        sent = fake.request_count - requests_before
+        result["requests_per_s"] = round(sent / total, 1)
+        result["requests_per_call"] = round(sent / iterations, 1)
+    print(f"{label:<28} p50 {result['p50_ms']:8.2f} ms   p95 {result['p95_ms']:8.2f} ms   "
+          f"{result['calls_per_s']:7.1f} chiamate/s"
+          + (f"   {result['requests_per_s']:7.1f} req/s" if fake is not None else ""))
+    return result
+
+
+def clear_caches():
+    # Misura il percorso di rete: senza questo ogni chiamata sarebbe un hit di cache
+    zoho_api.invalidate_cache()
+
+
+def run_suite(fake, iterations):
+    projects, error = zoho_api.get_projects(PORTAL_ID)
+    if error:
+        raise SystemExit(f"Impossibile leggere i progetti: {error}")
+    project_id = projects[0]["id"]
+    log_entry = {
+        "portal_id": PORTAL_ID, "project_id": project_id, "task_id": "1",
+        "event_name": "Benchmark", "notes": "", "log_date": "2024-01-01",
+        "start_time": "09:00", "end_time": "10:00", "bill_status": "Billable",
+        "owner_zpuid": "9001",
+    }
+    scenarios = [
+        ("get_projects", lambda: zoho_api.get_projects(PORTAL_ID), iterations),
+        ("get_tasks", lambda: zoho_api.get_tasks(PORTAL_ID, project_id), iterations),
+        ("get_all_tasks_parallel",
+         lambda: zoho_api.get_all_tasks_parallel(PORTAL_ID, projects), max(1, iterations // 10)),
+        ("get_all_users", lambda: zoho_api.get_all_users(PORTAL_ID), iterations),
+        ("log_time_to_zoho", lambda: zoho_api.log_time_to_zoho(**log_entry), iterations),
+    ]
+    return {label: measure(label, call, count, fake, setup=clear_caches)
+            for label, call, count in scenarios}
+
+
+def run_session_comparison(fake, iterations):
+    """Bare requests.get (new connection each time) vs the pooled zoho_api session."""
+    url = f"{fake.url}/api/v3/portal/{PORTAL_ID}/projects?page=1&per_page=100"
+    headers = {"Authorization": "Zoho-oauthtoken fake-access-token"}
+    results = {}
+    connections = fake.connection_count
+    results["requests.get (senza pool)"] = measure(
+        "requests.get (senza pool)", lambda: requests.get(url, headers=headers), iterations, fake)
+    print(f"  connessioni aperte: {fake.connection_count - connections}")
+    connections = fake.connection_count
+    results["zoho_api._make_api_call"] = measure(
+        "zoho_api._make_api_call", lambda: zoho_api._make_api_call("GET", url), iterations, fake)
+    print(f"  connessioni aperte: {fake.connection_count - connections}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns the scenarios whose p95 is worse than the baseline by more than tolerance."""
+    regressions = []
+    for label, result in results.items():
+        previous = baseline.get(label)
+        if previous and result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {previous['p95_ms']} -> {result['p95_ms']} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark di zoho_api contro il server Zoho locale")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--handshake-ms", type=float, default=20,
+                        help="ritardo per ogni nuova connessione (simula TLS)")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=20, help="task per progetto")
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--real-quotas", action="store_true",
+                        help="mantiene le quote API_QUOTAS invece di disattivarle")
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--metrics", action="store_true",
+                        help="stampa gli istogrammi interni di zoho_api (chiamate, cache, HTTP)")
+    parser.add_argument("--baseline", help="risultati precedenti con cui confrontarsi")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="peggioramento massimo ammesso del p95 (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    fake = FakeZohoServer(latency=args.latency_ms / 1000,
+                          latency_jitter=args.jitter_ms / 1000,
+                          handshake_latency=args.handshake_ms / 1000,
+                          error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                          retry_after=args.retry_after, seed=1,
+                          dataset=build_dataset(args.projects, args.tasks, args.users)).start()
+    use_fake_server(fake)
+    # Cache su disco temporanea, per non toccare zoho_cache.db
+    cache_dir = tempfile.mkdtemp(prefix="bench_zoho_")
+    zoho_api._disk_cache = DiskCache(os.path.join(cache_dir, "zoho_cache.db"))
+    if not args.real_quotas:
+        zoho_api.configure_rate_limits(
+            {name: (10 ** 9, 1) for name in [*zoho_api.API_QUOTAS, "default"]},
+            global_quota=(10 ** 9, 1))
+    zoho_api.get_access_token()
+
+    print("--- Sessione HTTP ---")
+    results = run_session_comparison(fake, args.iterations)
+    print("--- Funzioni zoho_api (cache svuotata a ogni chiamata) ---")
+    results.update(run_suite(fake, args.iterations))
+    print(f"Richieste totali: {fake.request_count}, errori iniettati: {fake.error_count}, "
+          f"429 iniettati: {fake.throttle_count}")
+    fake.stop()
+    if args.metrics:
+        print(instrumentation.metrics.report())
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressioni rispetto alla baseline:")
+            for line in regressions:
+                print(f"- {line}")
+            sys.exit(1)
+        print("Nessuna regressione rispetto alla baseline.")
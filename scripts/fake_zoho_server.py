@@ -0,0 +1,228 @@
+# Local stand-in for the Zoho endpoints used by calendar_logger.zoho_api.
+# Usage: python scripts/fake_zoho_server.py [--port 8765] [--latency-ms 20]
+#        [--error-rate 0.05] [--throttle-rate 0.1] [--projects 300]
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+USER_EMAIL = "utente@example.com"
+
+
+def build_dataset(projects=50, tasks_per_project=20, users=300):
+    """Generates projects, tasks and users shaped like the Zoho v3 responses.
+
+    Projects and tasks carry last_modified_time (epoch ms), used to answer
+    the incremental sync filter.
+    """
+    statuses = ["In corso", "In sospeso", "In entrata", "Fase Finale", "Chiuso"]
+    modified = int(time.time() * 1000)
+    dataset = {"projects": [], "tasks": {}, "users": []}
+    for p in range(1, projects + 1):
+        project_id = str(1000 + p)
+        dataset["projects"].append({
+            "id": project_id,
+            "name": f"Progetto {p}",
+            "status": {"name": statuses[p % len(statuses)]},
+            "last_modified_time": modified,
+        })
+        dataset["tasks"][project_id] = [{
+            "id": f"{project_id}{t:04d}",
+            "name": f"Task {t} del progetto {p}",
+            "owners_and_work": {"owners": [
+                {"email": USER_EMAIL if t % 3 == 0 else f"altro{t}@example.com"}]},
+            "last_modified_time": modified,
+        } for t in range(1, tasks_per_project + 1)]
+    dataset["users"] = [{
+        "id": str(9000 + u),
+        "email": USER_EMAIL if u == 1 else f"utente{u}@example.com",
+        "full_name": f"Utente {u}",
+    } for u in range(1, users + 1)]
+    return dataset
+
+
+class FakeZohoServer:
+    """Threaded HTTP/1.1 server answering the token and /api/v3/portal/... routes.
+
+    ``latency`` (plus a random ``latency_jitter``) is added to every request;
+    ``handshake_latency`` is paid once per TCP connection, to mimic the cost
+    of a TLS handshake. A fraction ``error_rate`` of API requests fails with
+    500 and a fraction ``throttle_rate`` with 429 and a Retry-After of
+    ``retry_after`` seconds. ``max_page_size`` caps per_page on paginated
+    routes, and ``default_page_size`` is used when the client omits it.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, handshake_latency=0.0, dataset=None,
+                 latency_jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 default_page_size=100, max_page_size=None, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.handshake_latency = handshake_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+        self.dataset = dataset or build_dataset()
+        self.request_count = 0
+        self.connection_count = 0
+        self.error_count = 0
+        self.throttle_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _count(self, attribute):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Header e body in un'unica scrittura, senza ritardi di Nagle
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                server._count("connection_count")
+                if server.handshake_latency:
+                    time.sleep(server.handshake_latency)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method):
+                server._count("request_count")
+                delay = server.latency
+                if server.latency_jitter:
+                    delay += server._roll() * server.latency_jitter
+                if delay:
+                    time.sleep(delay)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                parts = [p for p in parsed.path.split("/") if p]
+                injected = server.inject(parts)
+                if injected:
+                    self._send_json(*injected)
+                    return
+                status, payload = server.route(method, parts, query)
+                self._send_json(status, payload)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        return Handler
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def inject(self, parts):
+        """Returns (status, payload, headers) for an injected failure, or None.
+
+        Only the /api/v3 routes fail: the token endpoint always answers.
+        """
+        if parts[:2] != ["api", "v3"]:
+            return None
+        roll = self._roll()
+        if roll < self.throttle_rate:
+            self._count("throttle_count")
+            return 429, {"error": "rate limit exceeded"}, {"Retry-After": str(self.retry_after)}
+        if roll < self.throttle_rate + self.error_rate:
+            self._count("error_count")
+            return 500, {"error": "internal error"}, None
+        return None
+
+    def route(self, method, parts, query):
+        """Returns (status, payload) for a request path split into parts."""
+        if method == "POST" and parts == ["oauth", "v2", "token"]:
+            return 200, {"access_token": "fake-access-token", "expires_in": 3600}
+        if len(parts) < 4 or parts[:3] != ["api", "v3", "portal"]:
+            return 404, {"error": "not found"}
+        rest = parts[4:]
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", [str(self.default_page_size)])[0])
+        if self.max_page_size:
+            per_page = min(per_page, self.max_page_size)
+        window = slice((page - 1) * per_page, page * per_page)
+        since = int(query.get("last_modified_time", ["0"])[0])
+
+        def modified(items):
+            if not since:
+                return items
+            return [item for item in items if item.get("last_modified_time", 0) >= since]
+
+        if method == "GET" and rest == ["projects"]:
+            return 200, modified(self.dataset["projects"])[window]
+        if method == "GET" and rest == ["users"]:
+            return 200, {"users": self.dataset["users"][window]}
+        if method == "GET" and len(rest) == 3 and rest[0] == "projects" and rest[2] == "tasks":
+            return 200, {"tasks": modified(self.dataset["tasks"].get(rest[1], []))[window]}
+        if method == "POST" and len(rest) == 3 and rest[0] == "projects" and rest[2] == "log":
+            return 200, {"time_logs": [{"id": str(self.request_count)}]}
+        return 404, {"error": "not found"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server Zoho locale per test e benchmark")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--handshake-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0, help="frazione di risposte 500")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="frazione di risposte 429")
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--max-page-size", type=int, default=None)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=20, help="task per progetto")
+    parser.add_argument("--users", type=int, default=300)
+    args = parser.parse_args()
+    fake = FakeZohoServer(port=args.port, latency=args.latency_ms / 1000,
+                          latency_jitter=args.jitter_ms / 1000,
+                          handshake_latency=args.handshake_ms / 1000,
+                          error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                          retry_after=args.retry_after, max_page_size=args.max_page_size,
+                          dataset=build_dataset(args.projects, args.tasks, args.users))
+    print(f"Server Zoho locale in ascolto su {fake.url}")
+    fake.serve_forever()